@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Async versions of the database operations in `db`
+
+Each operation runs its `db` counterpart through `AsyncSession.run_sync`, which
+awaits the async driver on the event loop wherever the sync code would block, so
+queries are written once and no thread is tied up while they run."""
+
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Concatenate,
+    Dict,
+    List,
+    Optional,
+    ParamSpec,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
+
+from rss_reader import db
+from rss_reader.db import AsyncSession, Feed, Post, Session, SQLModel, UnreadCount, User, UserBase
+
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+async def run_sync(
+    session: AsyncSession,
+    fn: Callable[Concatenate[Session, P], T],
+    *args: P.args,
+    **kwargs: P.kwargs
+) -> T:
+    """Run a `db` operation with the sync session of `session`, which is a SQLModel
+    `Session`, although `AsyncSession.run_sync` is typed for SQLAlchemy's"""
+    return await session.run_sync(cast(Callable[..., T], fn), *args, **kwargs)
+
+
+async def add_user(session: AsyncSession, user: User) -> User:
+    """Add a user to the database"""
+    return await run_sync(session, db.add_user, user)
+
+
+async def add_users(session: AsyncSession, users: List[User]) -> Dict[str, int]:
+    """Add several users to the database, skipping those whose username already exists"""
+    return await run_sync(session, db.add_users, users)
+
+
+async def get_users(
+    session: AsyncSession, offset: int = 0, limit: int = 10, after: Optional[int] = None
+) -> List[User]:
+    """Get all users from the database, ordered by id"""
+    return await run_sync(session, db.get_users, offset, limit, after)
+
+
+async def get_rows(
+    session: AsyncSession,
+    model: Type[SQLModel],
+    offset: int = 0,
+    limit: int = 10,
+    after: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Get the rows of the table of `model` as plain dicts, ordered by id"""
+    return await run_sync(session, db.get_rows, model, offset, limit, after)
+
+
+async def get_user(session: AsyncSession, username: str) -> Optional[User]:
+    """Get a user from the database"""
+    return await run_sync(session, db.get_user, username)
+
+
+async def update_user(session: AsyncSession, username: str, user: UserBase) -> Optional[User]:
+    """Update a user in the database"""
+    return await run_sync(session, db.update_user, username, user)
+
+
+async def delete_user(session: AsyncSession, username: str) -> Optional[User]:
+    """Delete a user from the database"""
+    return await run_sync(session, db.delete_user, username)
+
+
+async def add_feed(session: AsyncSession, feed: Feed) -> Feed:
+    """Add a feed to the database"""
+    return await run_sync(session, db.add_feed, feed)
+
+
+async def add_feeds(session: AsyncSession, feeds: List[Feed]) -> Dict[str, int]:
+    """Add several feeds to the database, skipping those whose URL already exists"""
+    return await run_sync(session, db.add_feeds, feeds)
+
+
+async def get_feed_ids(session: AsyncSession, urls: List[str]) -> Dict[str, int]:
+    """Get the ids of the feeds stored with any of the given URLs, by URL"""
+    return await run_sync(session, db.get_feed_ids, urls)
+
+
+async def update_feed(session: AsyncSession, feed: Feed) -> Optional[Feed]:
+    """Update a feed in the database, returning None if it has been deleted since it
+    was read"""
+    return await run_sync(session, db.update_feed, feed)
+
+
+async def update_feeds(session: AsyncSession, feeds: List[Feed]) -> List[int]:
+    """Update several feeds in the database in a single transaction, skipping those
+    deleted since they were read. Return the ids of the feeds updated."""
+    return await run_sync(session, db.update_feeds, feeds)
+
+
+async def get_due_feeds(session: AsyncSession, now: datetime, limit: int = 100) -> List[Feed]:
+    """Get the feeds due to be fetched by `now`, the most overdue first"""
+    return await run_sync(session, db.get_due_feeds, now, limit)
+
+
+async def get_feeds(
+    session: AsyncSession, offset: int = 0, limit: int = 10, after: Optional[int] = None
+) -> List[Feed]:
+    """Get all feeds from the database, ordered by id"""
+    return await run_sync(session, db.get_feeds, offset, limit, after)
+
+
+async def get_feed(session: AsyncSession, feed_id: int) -> Optional[Feed]:
+    """Get a feed from the database"""
+    return await run_sync(session, db.get_feed, feed_id)
+
+
+async def delete_feed(session: AsyncSession, feed_id: int) -> Optional[Feed]:
+    """Delete a feed from the database"""
+    return await run_sync(session, db.delete_feed, feed_id)
+
+
+async def subscribe(session: AsyncSession, user_id: int, feed_id: int) -> bool:
+    """Subscribe a user to a feed, raising ValueError if either doesn't exist"""
+    return await run_sync(session, db.subscribe, user_id, feed_id)
+
+
+async def unsubscribe(session: AsyncSession, user_id: int, feed_id: int) -> bool:
+    """Unsubscribe a user from a feed"""
+    return await run_sync(session, db.unsubscribe, user_id, feed_id)
+
+
+async def get_subscriptions(session: AsyncSession, user_id: int) -> List[Feed]:
+    """Get the feeds a user is subscribed to, ordered by id"""
+    return await run_sync(session, db.get_subscriptions, user_id)
+
+
+async def get_timeline(
+    session: AsyncSession,
+    user_id: int,
+    limit: int = 10,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[Post]:
+    """Get the posts of the timeline of a user, latest first"""
+    return await run_sync(session, db.get_timeline, user_id, limit, before)
+
+
+async def mark_read(session: AsyncSession, user_id: int, post_ids: List[int]) -> int:
+    """Mark posts of the timeline of a user as read"""
+    return await run_sync(session, db.mark_read, user_id, post_ids)
+
+
+async def mark_all_read(session: AsyncSession, user_id: int, feed_id: Optional[int] = None) -> int:
+    """Mark all posts of the timeline of a user as read, or only those of `feed_id`"""
+    return await run_sync(session, db.mark_all_read, user_id, feed_id)
+
+
+async def get_unread_counts(session: AsyncSession, user_id: int) -> List[UnreadCount]:
+    """Get the number of unread posts of each feed a user is subscribed to"""
+    return await run_sync(session, db.get_unread_counts, user_id)
+
+
+async def upsert_posts(session: AsyncSession, posts: List[Dict[str, Any]]) -> int:
+    """Insert or update posts in the database, keyed by their `post_id`"""
+    return await run_sync(session, db.upsert_posts, posts)
@@ -10,112 +10,484 @@
 
 """API definition and endpoints"""
 
-from typing import List
+import asyncio
+import base64
+import math
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple, Union
 
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 
-from rss_reader import db, feedsvc
+from rss_reader import (
+    aiodb,
+    cache,
+    db,
+    export,
+    feedsvc,
+    importer,
+    metrics,
+    profiling,
+    scheduler,
+    slowlog,
+)
 
 
-app = FastAPI()
-engine = db.create_engine()
+FAST_JSON = os.getenv("RSS_READER_FAST_JSON", "false").lower() in {"1", "true", "yes"}
 
 
-def get_session():
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Release the resources shared by the endpoints when the app shuts down"""
+    yield
+    await feedsvc.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+if profiling.enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
+engine = db.create_async_engine()
+cache_backend = cache.create_cache()
+
+
+async def get_session():
     """Return a database session, necessary for dependency injection"""
-    with db.Session(engine) as session:
+    async with db.create_async_session(engine) as session:
         yield session
 
 
+def encode_cursor(last_id: int) -> str:
+    """Encode the id of the last item of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Decode a cursor back to the id of the last item of a page"""
+    if cursor is None:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from err
+
+
+def encode_timeline_cursor(last_post: db.Post) -> str:
+    """Encode the timeline key of the last post of a page as an opaque cursor"""
+    published, post_id = db.timeline_key(last_post)
+    key = f"{published.isoformat()},{post_id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_timeline_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Decode a cursor back to the timeline key of the last post of a page"""
+    if cursor is None:
+        return None
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        published, post_id = key.split(",")
+        return datetime.fromisoformat(published), int(post_id)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from err
+
+
+def set_next_cursor(
+    response: Response, items: Sequence[Union[db.User, db.Feed]], limit: int
+) -> None:
+    """Point to the next page with the `X-Next-Cursor` header if the page is full"""
+    if items and len(items) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(db.stored_id(items[-1]))
+
+
+def fast_json_response(rows: List[Dict[str, Any]], limit: int) -> Response:
+    """Respond with rows serialized straight to JSON by orjson, skipping the validation
+    of the response model, pointing to the next page like `set_next_cursor`"""
+    response = ORJSONResponse(rows)
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["id"])
+    return response
+
+
 @app.post("/users/", status_code=201)
-def create_user(*, session: db.Session = Depends(get_session), user: db.UserBase) -> db.User:
+async def create_user(
+    *, session: db.AsyncSession = Depends(get_session), user: db.UserBase
+) -> db.User:
     """Create a new user"""
     new_user = db.User.from_orm(user)
     try:
-        return db.add_user(session, new_user)
+        return await aiodb.add_user(session, new_user)
     except ValueError as err:
         raise HTTPException(status_code=409, detail=str(err)) from err
 
 
+@app.post("/users/batch")
+async def create_users(
+    *, session: db.AsyncSession = Depends(get_session), users: List[db.UserBase]
+) -> List[db.UserResult]:
+    """Create several users at once, reporting for each whether it was created or
+    already existed"""
+    ids = await aiodb.add_users(session, [db.User.from_orm(user) for user in users])
+    results = []
+    for username in (user.username for user in users):
+        if (user_id := ids.pop(username, None)) is not None:
+            results.append(db.UserResult(username=username, status="created", id=user_id))
+        else:
+            results.append(db.UserResult(username=username, status="exists"))
+    return results
+
+
 @app.get("/users/")
-def read_users(
+async def read_users(
     *,
-    session: db.Session = Depends(get_session),
+    session: db.AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
+    after: Optional[str] = None,
     limit: int = Query(default=100, le=100),
 ) -> List[db.User]:
-    """Return a list of users"""
-    return db.get_users(session, offset=offset, limit=limit)
+    """Return a list of users, paginated by offset or by the cursor of a previous page"""
+    if FAST_JSON:
+        rows = await aiodb.get_rows(session, db.User, offset, limit, decode_cursor(after))
+        return fast_json_response(rows, limit)  # type: ignore[return-value]
+    users = await aiodb.get_users(session, offset=offset, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, users, limit)
+    return users
 
 
 @app.get("/users/{username}")
-def read_user(*, session: db.Session = Depends(get_session), username: str) -> db.User:
+async def read_user(*, session: db.AsyncSession = Depends(get_session), username: str) -> db.User:
     """Return a user"""
-    user = db.get_user(session, username=username)
+    user = await cache.get_user(cache_backend, session, username=username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
 @app.patch("/users/{username}")
-def update_user(
+async def update_user(
     *,
-    session: db.Session = Depends(get_session),
+    session: db.AsyncSession = Depends(get_session),
     username: str,
     user: db.UserBase,
 ) -> db.User:
     """Update a user"""
     try:
-        updated_user = db.update_user(session, username=username, user=user)
+        updated_user = await aiodb.update_user(session, username=username, user=user)
     except ValueError as err:
         raise HTTPException(status_code=409, detail=str(err)) from err
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
+    await cache_backend.delete(cache.user_key(username), cache.user_key(updated_user.username))
     return updated_user
 
 
 @app.delete("/users/{username}", status_code=204)
-def delete_user(*, session: db.Session = Depends(get_session), username: str) -> None:
+async def delete_user(*, session: db.AsyncSession = Depends(get_session), username: str) -> None:
     """Delete a user"""
-    user = db.delete_user(session, username=username)
+    user = await aiodb.delete_user(session, username=username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await cache_backend.delete(cache.user_key(username))
+
+
+async def find_user_id(session: db.AsyncSession, username: str) -> int:
+    """Return the id of a user, or respond with 404 if it doesn't exist"""
+    user = await cache.get_user(cache_backend, session, username=username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    return db.stored_id(user)
+
+
+@app.get("/users/{username}/subscriptions/")
+async def read_subscriptions(
+    *, session: db.AsyncSession = Depends(get_session), username: str
+) -> List[db.Feed]:
+    """Return the feeds a user is subscribed to"""
+    user_id = await find_user_id(session, username)
+    return await aiodb.get_subscriptions(session, user_id)
+
+
+@app.put("/users/{username}/subscriptions/{feed_id}", status_code=204)
+async def subscribe(
+    *, session: db.AsyncSession = Depends(get_session), username: str, feed_id: int
+) -> None:
+    """Subscribe a user to a feed"""
+    user_id = await find_user_id(session, username)
+    if not await cache.get_feed(cache_backend, session, feed_id=feed_id):
+        raise HTTPException(status_code=404, detail="Feed not found")
+    try:
+        await aiodb.subscribe(session, user_id, feed_id)
+    except ValueError as err:
+        raise HTTPException(status_code=404, detail=str(err)) from err
+
+
+@app.delete("/users/{username}/subscriptions/{feed_id}", status_code=204)
+async def unsubscribe(
+    *, session: db.AsyncSession = Depends(get_session), username: str, feed_id: int
+) -> None:
+    """Unsubscribe a user from a feed"""
+    user_id = await find_user_id(session, username)
+    if not await aiodb.unsubscribe(session, user_id, feed_id):
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+
+@app.post("/users/{username}/subscriptions/read", status_code=204)
+async def mark_all_read(*, session: db.AsyncSession = Depends(get_session), username: str) -> None:
+    """Mark all posts of all the feeds a user is subscribed to as read"""
+    user_id = await find_user_id(session, username)
+    await aiodb.mark_all_read(session, user_id)
+
+
+@app.post("/users/{username}/subscriptions/{feed_id}/read", status_code=204)
+async def mark_feed_read(
+    *, session: db.AsyncSession = Depends(get_session), username: str, feed_id: int
+) -> None:
+    """Mark all posts of a feed a user is subscribed to as read"""
+    user_id = await find_user_id(session, username)
+    if not await aiodb.mark_all_read(session, user_id, feed_id):
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+
+@app.post("/users/{username}/read", status_code=204)
+async def mark_read(
+    *, session: db.AsyncSession = Depends(get_session), username: str, post_ids: List[int]
+) -> None:
+    """Mark posts of the timeline of a user as read"""
+    user_id = await find_user_id(session, username)
+    await aiodb.mark_read(session, user_id, post_ids)
+
+
+@app.get("/users/{username}/unread")
+async def read_unread_counts(
+    *, session: db.AsyncSession = Depends(get_session), username: str
+) -> List[db.UnreadCount]:
+    """Return the number of unread posts of each feed a user is subscribed to"""
+    user_id = await find_user_id(session, username)
+    return await aiodb.get_unread_counts(session, user_id)
+
+
+@app.get("/users/{username}/timeline")
+async def read_timeline(
+    *,
+    session: db.AsyncSession = Depends(get_session),
+    response: Response,
+    username: str,
+    after: Optional[str] = None,
+    limit: int = Query(default=100, le=100),
+) -> List[db.Post]:
+    """Return the posts of the feeds a user is subscribed to, latest first, paginated by
+    the cursor of a previous page"""
+    user_id = await find_user_id(session, username)
+    before = decode_timeline_cursor(after)
+    posts = await aiodb.get_timeline(session, user_id, limit=limit, before=before)
+    if posts and len(posts) == limit:
+        response.headers["X-Next-Cursor"] = encode_timeline_cursor(posts[-1])
+    return posts
+
+
+async def refresh(session: db.AsyncSession, feed_id: int) -> Optional[db.Feed]:
+    """Fetch a stored feed again, writing it back only if it has changed, and raising
+    FetchError, with the feed left untouched, if it can't be fetched. Return None if
+    the feed doesn't exist, or was deleted while it was fetched."""
+    feed = await aiodb.get_feed(session, feed_id)
+    if not feed:
+        return None
+    # end the transaction, so that no connection is held while the feed is fetched
+    await session.commit()
+    posts = await feedsvc.replenish(feed)
+    if posts is not None:
+        feed = await aiodb.update_feed(session, feed)
+        if not feed:
+            return None
+        await cache_backend.delete(cache.feed_key(feed_id))
+        await store_posts(session, feed, posts)
+    return feed
+
+
+async def store_posts(
+    session: db.AsyncSession, feed: db.Feed, posts: List[Dict[str, Any]]
+) -> None:
+    """Store the posts of a feed"""
+    posts = [dict(post, feed_id=feed.id) for post in posts]
+    await aiodb.upsert_posts(session, posts)
+
+
+async def replenish_feed(feed_id: int) -> None:
+    """Replenish a feed that was stored before being fetched"""
+    async with db.create_async_session(engine) as session:
+        try:
+            await refresh(session, feed_id)
+        except feedsvc.FetchError:
+            pass
 
 
 @app.post("/feeds/", status_code=201)
-def create_feed(*, session: db.Session = Depends(get_session), feed: db.FeedBase) -> db.Feed:
-    """Create a new feed"""
-    new_feed = db.Feed.from_orm(feed)
-    feedsvc.replenish(new_feed)
+async def create_feed(
+    *,
+    session: db.AsyncSession = Depends(get_session),
+    background_tasks: BackgroundTasks,
+    feed: db.FeedBase,
+    defer: bool = False,
+) -> db.Feed:
+    """Create a new feed, replenishing it right away or, if deferred, after responding"""
+    new_feed, posts = db.Feed.from_orm(feed), []
+    if await aiodb.get_feed_ids(session, [new_feed.url]):
+        raise HTTPException(status_code=409, detail="Feed already exists")
+    # end the transaction, so that no connection is held while the feed is fetched
+    await session.commit()
+    if not defer:
+        try:
+            posts = await feedsvc.replenish(new_feed) or []
+        except feedsvc.FetchError:
+            pass
+        scheduler.reschedule(new_feed, changed=True)
     try:
-        return db.add_feed(session, new_feed)
+        new_feed = await aiodb.add_feed(session, new_feed)
     except ValueError as err:
         raise HTTPException(status_code=409, detail=str(err)) from err
+    if defer:
+        background_tasks.add_task(replenish_feed, db.stored_id(new_feed))
+    else:
+        await store_posts(session, new_feed, posts)
+    return new_feed
+
+
+@app.post("/feeds/import")
+async def import_feeds(
+    *, session: db.AsyncSession = Depends(get_session), request: Request
+) -> List[importer.ImportResult]:
+    """Import feeds from an OPML document, a JSON array of URLs or one URL per line"""
+    try:
+        urls = importer.parse_feed_list(await request.body())
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
+    return await importer.import_feeds(session, urls)
+
+
+@app.post("/feeds/{feed_id}/refresh")
+async def refresh_feed(
+    *, session: db.AsyncSession = Depends(get_session), feed_id: int
+) -> db.Feed:
+    """Fetch a feed again, conditionally on it having changed since the last fetch"""
+    try:
+        feed = await refresh(session, feed_id)
+    except feedsvc.FetchSkipped as err:
+        raise HTTPException(
+            status_code=503,
+            detail="Feed fetch is backing off",
+            headers={"Retry-After": str(math.ceil(err.retry_after))},
+        ) from err
+    except feedsvc.FetchError as err:
+        raise HTTPException(status_code=502, detail="Failed to fetch feed") from err
+    if not feed:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return feed
 
 
 @app.get("/feeds/")
-def read_feeds(
+async def read_feeds(
     *,
-    session: db.Session = Depends(get_session),
+    session: db.AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
+    after: Optional[str] = None,
     limit: int = Query(default=100, le=100),
 ) -> List[db.Feed]:
-    """Return a list of feeds"""
-    return db.get_feeds(session, offset=offset, limit=limit)
+    """Return a list of feeds, paginated by offset or by the cursor of a previous page"""
+    if FAST_JSON:
+        rows = await aiodb.get_rows(session, db.Feed, offset, limit, decode_cursor(after))
+        return fast_json_response(rows, limit)  # type: ignore[return-value]
+    feeds = await aiodb.get_feeds(session, offset=offset, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, feeds, limit)
+    return feeds
 
 
 @app.get("/feeds/{feed_id}")
-def read_feed(*, session: db.Session = Depends(get_session), feed_id: int) -> db.Feed:
+async def read_feed(*, session: db.AsyncSession = Depends(get_session), feed_id: int) -> db.Feed:
     """Return a feed"""
-    feed = db.get_feed(session, feed_id=feed_id)
+    feed = await cache.get_feed(cache_backend, session, feed_id=feed_id)
     if not feed:
         raise HTTPException(status_code=404, detail="Feed not found")
     return feed
 
 
 @app.delete("/feeds/{feed_id}", status_code=204)
-def delete_feed(*, session: db.Session = Depends(get_session), feed_id: int) -> None:
+async def delete_feed(*, session: db.AsyncSession = Depends(get_session), feed_id: int) -> None:
     """Delete a feed"""
-    feed = db.delete_feed(session, feed_id=feed_id)
+    feed = await aiodb.delete_feed(session, feed_id=feed_id)
     if not feed:
         raise HTTPException(status_code=404, detail="Feed not found")
+    await cache_backend.delete(cache.feed_key(feed_id))
+
+
+@app.get("/export/{table}", response_class=StreamingResponse)
+async def export_table(table: Literal["users", "feeds", "posts"]) -> StreamingResponse:
+    """Stream all rows of a table as newline-delimited JSON"""
+    return StreamingResponse(export.export(engine, table), media_type="application/x-ndjson")
+
+
+@app.get("/admin/stats")
+async def read_stats() -> Dict[str, Dict[str, Any]]:
+    """Return runtime statistics of the service"""
+    return {
+        "fetcher": feedsvc.stats(),
+        "cache": cache.stats(cache_backend),
+        "pool": db.pool_stats(engine),
+    }
+
+
+def authorize_profiles(authorization: Optional[str] = Header(default=None)) -> None:
+    """Respond with 404 if profiling is disabled, and with 403 unless the request carries
+    the profile token as a bearer token"""
+    if not profiling.enabled(profiling.PROFILE_TOKEN, profiling.PROFILE_SAMPLE_RATE):
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiling.authorized(authorization):
+        raise HTTPException(status_code=403, detail="Not authorized to read profiles")
+
+
+@app.get("/admin/profiles/", dependencies=[Depends(authorize_profiles)])
+async def read_profiles() -> List[Dict[str, Any]]:
+    """Return the saved request profiles, latest first"""
+    return await asyncio.to_thread(profiling.list_profiles, profiling.PROFILE_DIR)
+
+
+@app.get(
+    "/admin/profiles/{profile_id}",
+    response_class=HTMLResponse,
+    dependencies=[Depends(authorize_profiles)],
+)
+async def read_profile(
+    profile_id: str, fmt: Literal["html", "speedscope"] = Query(default="html", alias="format")
+) -> Response:
+    """Return a saved request profile as an HTML flame graph or as speedscope JSON"""
+    content = await asyncio.to_thread(profiling.render, profile_id, fmt, profiling.PROFILE_DIR)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if fmt == "speedscope":
+        return Response(content=content, media_type="application/json")
+    return HTMLResponse(content=content)
+
+
+@app.get("/admin/slow-queries")
+async def read_slow_queries(limit: int = Query(default=10, ge=1, le=100)) -> List[Dict[str, Any]]:
+    """Return the slow statements with the most total time, with their normalized text,
+    the shape of their parameters, their durations and their plan, if captured"""
+    return slowlog.get_slow_query_log().top(limit)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics() -> Response:
+    """Return the metrics of the service in the Prometheus text format"""
+    content, media_type = metrics.exposition()
+    return Response(content=content, media_type=media_type)
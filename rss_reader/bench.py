@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Benchmarks of the API and of the database operations behind it
+
+Each benchmark seeds its own rows, under names unique to the run, which are deleted
+once it's done, and reports the latency percentiles of an operation along with the
+number of SQL statements it issued, which is the number of round trips to the
+database besides the commit.
+
+Endpoints are driven concurrently through the ASGI app in process, and feeds are
+fetched from a local HTTP server that serves the fixtures of the test suite, so
+benchmarks run offline and can be compared between releases."""
+
+import asyncio
+import functools
+import http.server
+import importlib.metadata
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+import httpx
+import sqlalchemy
+from sqlmodel import col
+
+from rss_reader import aiodb, api, db, feedsvc, importer
+
+
+BENCH_ITERATIONS = int(os.getenv("RSS_READER_BENCH_ITERATIONS", "200"))
+BENCH_CONCURRENCY = int(os.getenv("RSS_READER_BENCH_CONCURRENCY", "10"))
+BENCH_USERS = int(os.getenv("RSS_READER_BENCH_USERS", "100"))
+BENCH_FEEDS = int(os.getenv("RSS_READER_BENCH_FEEDS", "100"))
+BENCH_SUBSCRIPTIONS = int(os.getenv("RSS_READER_BENCH_SUBSCRIPTIONS", "10"))
+BENCH_FIXTURES = os.getenv("RSS_READER_BENCH_FIXTURES", "tests/fixtures")
+
+Request = Tuple[str, str, Any]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of the samples"""
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples: List[float], statements: int) -> Dict[str, float]:
+    """Summarize latency samples, in seconds, as milliseconds"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": 1000 * sum(samples) / len(samples),
+        "p50_ms": 1000 * percentile(samples, 0.5),
+        "p95_ms": 1000 * percentile(samples, 0.95),
+        "p99_ms": 1000 * percentile(samples, 0.99),
+        "statements_per_op": statements / len(samples),
+    }
+
+
+@contextmanager
+def count_statements(engine: db.AsyncEngine) -> Iterator[List[str]]:
+    """Collect the SQL statements executed by the engine while in the context"""
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def measure(
+    engine: db.AsyncEngine,
+    operation: Callable[[db.AsyncSession, int], Awaitable[Any]],
+    iterations: int,
+) -> Dict[str, float]:
+    """Time `operation` over `iterations`, each in a session of its own like a request"""
+    samples = []
+    with count_statements(engine) as statements:
+        for i in range(iterations):
+            async with db.create_async_session(engine) as session:
+                start = time.perf_counter()
+                await operation(session, i)
+                samples.append(time.perf_counter() - start)
+    return summarize(samples, len(statements))
+
+
+def delete_run(session: db.Session, run_id: str) -> None:
+    """Delete the users and feeds created by a run of the benchmarks, along with their
+    subscriptions, posts and timelines"""
+    username = col(db.User.username)
+    db.execute(
+        session,
+        sqlalchemy.delete(db.User).where(username.startswith(f"bench_{run_id}_", autoescape=True)),
+    )
+    url = col(db.Feed.url)
+    db.execute(
+        session,
+        sqlalchemy.delete(db.Feed).where(url.contains(f"bench={run_id}-", autoescape=True)),
+    )
+    session.commit()
+
+
+async def cleanup(engine: db.AsyncEngine, run_id: str) -> None:
+    """Delete what a run of the benchmarks created, so that no bench row is left to be
+    listed, or polled by the scheduler"""
+    async with db.create_async_session(engine) as session:
+        await aiodb.run_sync(session, delete_run, run_id)
+
+
+async def bench_mutations(
+    engine: db.AsyncEngine, iterations: int = BENCH_ITERATIONS
+) -> Dict[str, Dict[str, float]]:
+    """Benchmark updating and deleting users and deleting feeds"""
+    run_id = uuid.uuid4().hex[:8]
+    try:
+        return await mutate(engine, run_id, iterations)
+    finally:
+        await cleanup(engine, run_id)
+
+
+async def mutate(
+    engine: db.AsyncEngine, run_id: str, iterations: int
+) -> Dict[str, Dict[str, float]]:
+    """Seed the rows of `bench_mutations` and measure their updates and deletes"""
+    usernames = [f"bench_{run_id}_{i}" for i in range(iterations)]
+    async with db.create_async_session(engine) as session:
+        await aiodb.add_users(session, [db.User(username=username) for username in usernames])
+        urls = [f"https://bench.invalid/?bench={run_id}-{i}" for i in range(iterations)]
+        feed_ids = list(
+            (await aiodb.add_feeds(session, [db.Feed(url=url) for url in urls])).values()
+        )
+
+    async def update_user(session: db.AsyncSession, i: int) -> None:
+        user = db.UserBase(username=f"{usernames[i]}_renamed")
+        await aiodb.update_user(session, usernames[i], user)
+
+    async def delete_user(session: db.AsyncSession, i: int) -> None:
+        await aiodb.delete_user(session, f"{usernames[i]}_renamed")
+
+    async def delete_feed(session: db.AsyncSession, i: int) -> None:
+        await aiodb.delete_feed(session, feed_ids[i])
+
+    return {
+        "update_user": await measure(engine, update_user, iterations),
+        "delete_user": await measure(engine, delete_user, iterations),
+        "delete_feed": await measure(engine, delete_feed, iterations),
+    }
+
+
+def version() -> str:
+    """Return the installed version of rss-reader"""
+    try:
+        return importlib.metadata.version("rss-reader")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    """FixtureHandler serves fixture files, ignoring query strings, without logging"""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@contextmanager
+def serve_fixtures(directory: str = BENCH_FIXTURES) -> Iterator[str]:
+    """Serve the files in `directory` over HTTP on a free local port, in a thread,
+    yielding the base URL of the server"""
+    handler = functools.partial(FixtureHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@dataclass(frozen=True)
+class BenchOptions:
+    """BenchOptions defines how much data the endpoint benchmarks seed and how hard
+    they drive the API"""
+
+    iterations: int = BENCH_ITERATIONS
+    concurrency: int = BENCH_CONCURRENCY
+    users: int = BENCH_USERS
+    feeds: int = BENCH_FEEDS
+    subscriptions: int = BENCH_SUBSCRIPTIONS
+    fixtures: str = BENCH_FIXTURES
+
+
+@dataclass
+class Seed:
+    """Seed holds the rows created for a run of the endpoint benchmarks"""
+
+    run_id: str
+    base_url: str
+    usernames: List[str]
+    feed_ids: List[int]
+    new_feed_urls: List[str]
+    post_ids: Dict[str, List[int]]
+
+
+async def subscribe(
+    session: db.AsyncSession, user_ids: Dict[str, int], feed_ids: List[int], subscriptions: int
+) -> Dict[str, List[int]]:
+    """Subscribe each user to `subscriptions` of the feeds, returning the ids of the
+    posts delivered to their timelines, by username"""
+    post_ids = {}
+    for i, (username, user_id) in enumerate(user_ids.items()):
+        for j in range(min(subscriptions, len(feed_ids))):
+            await aiodb.subscribe(session, user_id, feed_ids[(i + j) % len(feed_ids)])
+        posts = await aiodb.get_timeline(session, user_id)
+        post_ids[username] = [db.stored_id(post) for post in posts]
+    return post_ids
+
+
+async def seed(engine: db.AsyncEngine, run_id: str, base_url: str, options: BenchOptions) -> Seed:
+    """Create users and feeds, fetched from the fixture server, and subscribe each
+    user to `options.subscriptions` of the feeds"""
+    usernames = [f"bench_{run_id}_{i}" for i in range(options.users)]
+    urls = [f"{base_url}/programming.rss?bench={run_id}-{i}" for i in range(options.feeds)]
+    async with db.create_async_session(engine) as session:
+        new_users = [db.User(username=username) for username in usernames]
+        user_ids = await aiodb.add_users(session, new_users)
+        results = await importer.import_feeds(session, urls)
+        feed_ids = [result.id for result in results if result.id is not None]
+        post_ids = await subscribe(session, user_ids, feed_ids, options.subscriptions)
+    return Seed(
+        run_id=run_id,
+        base_url=base_url,
+        usernames=usernames,
+        feed_ids=feed_ids,
+        new_feed_urls=[
+            f"{base_url}/programming.rss?bench={run_id}-new-{i}" for i in range(options.iterations)
+        ],
+        post_ids=post_ids,
+    )
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    engine: db.AsyncEngine,
+    make_request: Callable[[int], Request],
+    iterations: int,
+    concurrency: int,
+) -> Dict[str, float]:
+    """Send `iterations` requests made by `make_request` from `concurrency` workers,
+    returning their latency summary along with the throughput and error count"""
+    samples: List[float] = []
+    errors = 0
+    indexes = iter(range(iterations))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in indexes:
+            method, url, body = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            samples.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    with count_statements(engine) as statements:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    summary = summarize(samples, len(statements))
+    summary["throughput_rps"] = len(samples) / elapsed if elapsed else 0.0
+    summary["errors"] = errors
+    return summary
+
+
+def scenarios(data: Seed) -> Dict[str, Callable[[int], Request]]:
+    """Return how to make the requests of each endpoint benchmark, in the order they
+    must run, since later ones update and delete what earlier ones create
+
+    Each request subscribes to, marks as read and unsubscribes from a subscription of
+    its own, as long as there are no more iterations than users times feeds"""
+    prefix = f"bench_{data.run_id}"
+
+    def username(i: int) -> str:
+        return data.usernames[i % len(data.usernames)]
+
+    def user(i: int) -> str:
+        return f"/users/{username(i)}"
+
+    def feed_id(i: int) -> int:
+        return data.feed_ids[i % len(data.feed_ids)]
+
+    def subscription(i: int) -> str:
+        return f"{user(i)}/subscriptions/{feed_id(i // len(data.usernames))}"
+
+    def import_urls(i: int) -> List[str]:
+        return [
+            f"{data.base_url}/programming.rss?bench={data.run_id}-import-{i}-{j}" for j in range(5)
+        ]
+
+    return {
+        "create_user": lambda i: ("POST", "/users/", {"username": f"{prefix}_new_{i}"}),
+        "create_users": lambda i: (
+            "POST",
+            "/users/batch",
+            [{"username": f"{prefix}_batch_{i}_{j}"} for j in range(10)],
+        ),
+        "read_users": lambda i: ("GET", "/users/", None),
+        "read_user": lambda i: ("GET", user(i), None),
+        "update_user": lambda i: (
+            "PATCH",
+            f"/users/{prefix}_new_{i}",
+            {"username": f"{prefix}_updated_{i}"},
+        ),
+        "create_feed": lambda i: ("POST", "/feeds/", {"url": data.new_feed_urls[i]}),
+        "read_feeds": lambda i: ("GET", "/feeds/", None),
+        "read_feed": lambda i: ("GET", f"/feeds/{feed_id(i)}", None),
+        "refresh_feed": lambda i: ("POST", f"/feeds/{feed_id(i)}/refresh", None),
+        "import_feeds": lambda i: ("POST", "/feeds/import", import_urls(i)),
+        "subscribe": lambda i: ("PUT", subscription(i), None),
+        "read_subscriptions": lambda i: ("GET", f"{user(i)}/subscriptions/", None),
+        "read_timeline": lambda i: ("GET", f"{user(i)}/timeline", None),
+        "read_unread_counts": lambda i: ("GET", f"{user(i)}/unread", None),
+        "mark_read": lambda i: ("POST", f"{user(i)}/read", data.post_ids[username(i)]),
+        "mark_feed_read": lambda i: ("POST", f"{subscription(i)}/read", None),
+        "mark_all_read": lambda i: ("POST", f"{user(i)}/subscriptions/read", None),
+        "unsubscribe": lambda i: ("DELETE", subscription(i), None),
+        "export_feeds": lambda i: ("GET", "/export/feeds", None),
+        "read_stats": lambda i: ("GET", "/admin/stats", None),
+        "delete_user": lambda i: ("DELETE", f"/users/{prefix}_updated_{i}", None),
+    }
+
+
+async def bench_endpoints(
+    engine: db.AsyncEngine, base_url: str, options: BenchOptions
+) -> Dict[str, Dict[str, float]]:
+    """Seed the database and drive each endpoint of the API concurrently, through the
+    ASGI app bound to `engine`, deleting the seeded rows and those created by the
+    requests when done"""
+    run_id = uuid.uuid4().hex[:8]
+    results = {}
+    previous_engine, api.engine = api.engine, engine
+    try:
+        data = await seed(engine, run_id, base_url, options)
+        transport = httpx.ASGITransport(app=api.app)  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in scenarios(data).items():
+                results[name] = await drive(
+                    client, engine, make_request, options.iterations, options.concurrency
+                )
+            async with db.create_async_session(engine) as session:
+                new_feed_ids = await aiodb.get_feed_ids(session, data.new_feed_urls)
+            paths = [f"/feeds/{feed_id}" for feed_id in new_feed_ids.values()]
+            results["delete_feed"] = await drive(
+                client,
+                engine,
+                lambda i: ("DELETE", paths[i], None),
+                len(paths),
+                options.concurrency,
+            )
+    finally:
+        api.engine = previous_engine
+        await cleanup(engine, run_id)
+    return results
+
+
+async def run(engine: db.AsyncEngine, options: BenchOptions) -> Dict[str, Any]:
+    """Run all benchmarks, returning their results along with the options used"""
+    started_at = datetime.now(timezone.utc)
+    with serve_fixtures(options.fixtures) as base_url:
+        # all feeds are served by the same local host, which must not be rate limited
+        feedsvc.get_fetcher().limiter = feedsvc.HostLimiter(options.concurrency, rate=0)
+        try:
+            endpoints = await bench_endpoints(engine, base_url, options)
+        finally:
+            await feedsvc.close()
+    return {
+        "meta": {
+            "version": version(),
+            "started_at": started_at.isoformat(),
+            "database": engine.dialect.name,
+            **asdict(options),
+        },
+        "endpoints": endpoints,
+        "mutations": await bench_mutations(engine, options.iterations),
+    }
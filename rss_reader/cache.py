@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Read-through cache for user and feed lookups
+
+The cache is kept in Redis when `RSS_READER_REDIS_URL` is set, and in an in-process
+LRU otherwise. Entries expire after `RSS_READER_CACHE_TTL` seconds and are
+invalidated explicitly when the underlying rows change."""
+
+import abc
+import functools
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type, TypeVar
+
+from redis import asyncio as redis
+
+from rss_reader import aiodb, db
+from rss_reader.logger import logger
+
+
+REDIS_URL = os.getenv("RSS_READER_REDIS_URL", None)
+CACHE_TTL = int(os.getenv("RSS_READER_CACHE_TTL", "60"))
+CACHE_SIZE = int(os.getenv("RSS_READER_CACHE_SIZE", "10000"))
+
+M = TypeVar("M", bound=db.SQLModel)
+
+
+@dataclass
+class CacheStats:
+    """CacheStats counts how lookups were served: hits by the cache, misses by the
+    database"""
+
+    hits: int = 0
+    misses: int = 0
+
+
+class Cache(abc.ABC):
+    """Cache defines the interface of a cache backend, which stores strings by key"""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Return the value stored under `key`, if any"""
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: str, ttl: int = CACHE_TTL) -> None:
+        """Store `value` under `key` for `ttl` seconds"""
+
+    @abc.abstractmethod
+    async def delete(self, *keys: str) -> None:
+        """Remove the values stored under `keys`"""
+
+    @abc.abstractmethod
+    async def clear(self) -> None:
+        """Remove all values"""
+
+
+class LRUCache(Cache):
+    """LRUCache keeps up to `size` values in process memory, evicting the least
+    recently used ones first
+
+    It must only be used from the event loop of the process, which serializes the
+    accesses to it"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        super().__init__()
+        self.size = size
+        self.entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        expires_at, value = self.entries.get(key, (0.0, None))
+        if expires_at <= time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int = CACHE_TTL) -> None:
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def clear(self) -> None:
+        self.entries.clear()
+
+
+class RedisCache(Cache):
+    """RedisCache keeps values in Redis, shared by all workers, under a common prefix
+
+    Redis errors are logged and treated as misses so that lookups fall back to the
+    database"""
+
+    prefix = "rss-reader:"
+
+    def __init__(self, redis_url: str):
+        super().__init__()
+        self.redis = redis.Redis.from_url(redis_url)
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.redis.get(self.prefix + key)
+        except redis.RedisError as err:
+            logger.warning("Failed to get %s from Redis: %r", key, err)
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str, ttl: int = CACHE_TTL) -> None:
+        try:
+            await self.redis.set(self.prefix + key, value, ex=ttl)
+        except redis.RedisError as err:
+            logger.warning("Failed to set %s in Redis: %r", key, err)
+
+    async def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            await self.redis.delete(*(self.prefix + key for key in keys))
+        except redis.RedisError as err:
+            logger.warning("Failed to delete %s from Redis: %r", keys, err)
+
+    async def clear(self) -> None:
+        async for key in self.redis.scan_iter(f"{self.prefix}*"):
+            await self.redis.delete(key)
+
+
+@functools.cache
+def create_cache(redis_url: Optional[str] = REDIS_URL) -> Cache:
+    """Create the cache, backed by Redis if `redis_url` is given"""
+    if redis_url:
+        logger.debug("Creating Redis cache with url %s", redis_url)
+        return RedisCache(redis_url)
+    logger.debug("Creating LRU cache with size %s", CACHE_SIZE)
+    return LRUCache()
+
+
+def user_key(username: str) -> str:
+    """Return the cache key of a user"""
+    return f"user:{username}"
+
+
+def feed_key(feed_id: int) -> str:
+    """Return the cache key of a feed"""
+    return f"feed:{feed_id}"
+
+
+async def read_through(
+    cache: Cache, key: str, model: Type[M], load: Callable[[], Awaitable[Optional[M]]]
+) -> Optional[M]:
+    """Read a `model` instance from the cache, or `load` it on a miss and cache it"""
+    if (cached := await cache.get(key)) is not None:
+        cache.stats.hits += 1
+        return model.parse_raw(cached)
+    cache.stats.misses += 1
+    instance = await load()
+    if instance is not None:
+        await cache.set(key, instance.json())
+    return instance
+
+
+async def get_user(cache: Cache, session: db.AsyncSession, username: str) -> Optional[db.User]:
+    """Get a user from the cache, or from the database on a miss"""
+    load = functools.partial(aiodb.get_user, session, username)
+    return await read_through(cache, user_key(username), db.User, load)
+
+
+async def get_feed(cache: Cache, session: db.AsyncSession, feed_id: int) -> Optional[db.Feed]:
+    """Get a feed from the cache, or from the database on a miss"""
+    load = functools.partial(aiodb.get_feed, session, feed_id)
+    return await read_through(cache, feed_key(feed_id), db.Feed, load)
+
+
+def stats(cache: Cache) -> Dict[str, int]:
+    """Return the hit and miss counts of the cache"""
+    return asdict(cache.stats)
@@ -11,9 +11,12 @@
 """This module provides the `rss_reader` console utility"""
 
 import argparse
+import asyncio
+import json
 import sys
+from typing import TextIO
 
-from rss_reader import db
+from rss_reader import bench, db, export, feedsvc, importer, scheduler
 
 
 def main():
@@ -26,19 +29,173 @@ def main():
         default=db.DATABASE_URL,
         help="The URL of the rss_reader database [default: %(default)s]",
     )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=db.POOL_SIZE,
+        help="The number of connections kept in the pool [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--pool-max-overflow",
+        type=int,
+        default=db.POOL_MAX_OVERFLOW,
+        help="The number of connections allowed beyond the pool size [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--pool-recycle",
+        type=int,
+        default=db.POOL_RECYCLE,
+        help="The age in seconds after which connections are replaced [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--pool-pre-ping",
+        action=argparse.BooleanOptionalAction,
+        default=db.POOL_PRE_PING,
+        help="Test connections for liveness on checkout [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--pool-timeout",
+        type=float,
+        default=db.POOL_TIMEOUT,
+        help="The seconds to wait for a connection from the pool [default: %(default)s]",
+    )
     parser.add_argument(
         "action",
         type=str,
-        choices=["create-tables", "drop-tables"],
+        choices=["bench", "create-tables", "drop-tables", "export", "import", "schedule"],
         help="The action to be performed",
     )
-    arguments = parser.parse_args(sys.argv[1:])
+    parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default="-",
+        help="The file to import feeds from, or to write exports and benchmark results to "
+        "[default: stdin/stdout]",
+    )
+    parser.add_argument(
+        "-t",
+        "--table",
+        type=str,
+        choices=export.TABLES,
+        default="feeds",
+        help="The table to export [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-n",
+        "--iterations",
+        type=int,
+        default=bench.BENCH_ITERATIONS,
+        help="The number of times each benchmarked operation runs [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=bench.BENCH_CONCURRENCY,
+        help="The number of requests benchmarks keep in flight [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=bench.BENCH_USERS,
+        help="The number of users seeded for benchmarks [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--feeds",
+        type=int,
+        default=bench.BENCH_FEEDS,
+        help="The number of feeds seeded for benchmarks [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--subscriptions",
+        type=int,
+        default=bench.BENCH_SUBSCRIPTIONS,
+        help="The number of feeds each seeded user subscribes to [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--fixtures",
+        type=str,
+        default=bench.BENCH_FIXTURES,
+        help="The directory of feed documents served to benchmarks [default: %(default)s]",
+    )
+    arguments = parser.parse_intermixed_args(sys.argv[1:])
+    pool_options = db.PoolOptions(
+        size=arguments.pool_size,
+        max_overflow=arguments.pool_max_overflow,
+        recycle=arguments.pool_recycle,
+        pre_ping=arguments.pool_pre_ping,
+        timeout=arguments.pool_timeout,
+    )
     match arguments.action:
+        case "bench":
+            engine = db.create_async_engine(arguments.database_url, pool_options)
+            with argparse.FileType("w")(arguments.path) as file:
+                asyncio.run(run_bench(engine, arguments, file))
         case "create-tables":
-            engine = db.create_engine(arguments.database_url)
+            engine = db.create_engine(arguments.database_url, pool_options)
             db.create_tables(engine)
         case "drop-tables":
-            engine = db.create_engine(arguments.database_url)
+            engine = db.create_engine(arguments.database_url, pool_options)
             db.drop_tables(engine)
+        case "export":
+            with argparse.FileType("w")(arguments.path) as file:
+                engine = db.create_async_engine(arguments.database_url, pool_options)
+                asyncio.run(export_table(engine, arguments.table, file))
+        case "import":
+            with argparse.FileType("rb")(arguments.path) as file:
+                content = file.read()
+            asyncio.run(import_feeds(arguments.database_url, pool_options, content))
+        case "schedule":
+            engine = db.create_engine(arguments.database_url, pool_options)
+            asyncio.run(schedule(engine))
         case _:
             parser.print_help()
+
+
+async def schedule(engine: db.Engine) -> None:
+    """Run the refresh scheduler, closing the fetcher when done"""
+    try:
+        await scheduler.run(engine)
+    finally:
+        await feedsvc.close()
+
+
+async def import_feeds(database_url: str, pool_options: db.PoolOptions, content: bytes) -> None:
+    """Import feeds and print the outcome for each URL"""
+    engine = db.create_async_engine(database_url, pool_options)
+    try:
+        async with db.create_async_session(engine) as session:
+            urls = importer.parse_feed_list(content)
+            for result in await importer.import_feeds(session, urls):
+                print(result.status, result.url, result.detail or "", sep="\t")
+    finally:
+        await feedsvc.close()
+        await engine.dispose()
+
+
+async def export_table(engine: db.AsyncEngine, table: str, file: TextIO) -> None:
+    """Export a table as NDJSON to `file`"""
+    try:
+        async for chunk in export.export(engine, table):
+            file.write(chunk)
+    finally:
+        await engine.dispose()
+
+
+async def run_bench(engine: db.AsyncEngine, arguments: argparse.Namespace, file: TextIO) -> None:
+    """Run the benchmarks and write their results as JSON to `file`"""
+    try:
+        options = bench.BenchOptions(
+            iterations=arguments.iterations,
+            concurrency=arguments.concurrency,
+            users=arguments.users,
+            feeds=arguments.feeds,
+            subscriptions=arguments.subscriptions,
+            fixtures=arguments.fixtures,
+        )
+        results = await bench.run(engine, options)
+    finally:
+        await engine.dispose()
+    json.dump(results, file, indent=2)
+    file.write("\n")
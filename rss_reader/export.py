@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Streaming export of stored data as newline-delimited JSON
+
+Rows are read through a server-side cursor, `EXPORT_BATCH_SIZE` at a time, and each
+batch is written out as soon as it arrives, so exports take constant memory however
+many rows there are."""
+
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Type
+
+import sqlalchemy
+
+from rss_reader import db
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("RSS_READER_EXPORT_BATCH_SIZE", "1000"))
+
+TABLES: Dict[str, Type[db.SQLModel]] = {"users": db.User, "feeds": db.Feed, "posts": db.Post}
+
+
+def to_json(value: Any) -> str:
+    """Serialize values the JSON encoder doesn't handle, which are only datetimes"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def export(
+    engine: db.AsyncEngine, table: str, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[str]:
+    """Export the rows of `table`, ordered by id, as chunks of NDJSON lines"""
+    rows_of = TABLES[table].__table__  # type: ignore[attr-defined]
+    query = sqlalchemy.select(rows_of).order_by(rows_of.c.id)
+    query = query.execution_options(yield_per=batch_size)
+    async with db.create_async_session(engine) as session:
+        result = await session.stream(query)
+        async for rows in result.mappings().partitions():
+            yield "".join(json.dumps(dict(row), default=to_json) + "\n" for row in rows)
@@ -8,16 +8,532 @@
 # https://opensource.org/licenses/BSD-3-Clause
 # Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
-"""Feed Service module"""
+"""Feed Service module
 
-import feedparser
+Concurrent replenishments of the same feed share a single fetch and parse: within the
+process, and across workers through Redis when `RSS_READER_REDIS_URL` is set."""
 
+import asyncio
+import enum
+import functools
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+import httpx
+from redis import asyncio as redis
+
+from rss_reader import cache, metrics, parser
 from rss_reader.db import Feed
+from rss_reader.logger import logger
+
+
+FETCH_TIMEOUT = float(os.getenv("RSS_READER_FETCH_TIMEOUT", "10"))
+FETCH_CONCURRENCY = int(os.getenv("RSS_READER_FETCH_CONCURRENCY", "20"))
+FETCH_MAX_BYTES = int(os.getenv("RSS_READER_FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+FETCH_HOST_CONCURRENCY = int(os.getenv("RSS_READER_FETCH_HOST_CONCURRENCY", "4"))
+FETCH_HOST_RATE = float(os.getenv("RSS_READER_FETCH_HOST_RATE", "5"))
+FAILURE_BACKOFF = float(os.getenv("RSS_READER_FETCH_FAILURE_BACKOFF", "60"))
+FAILURE_MAX_BACKOFF = float(os.getenv("RSS_READER_FETCH_FAILURE_MAX_BACKOFF", "86400"))
+HOST_FAILURE_THRESHOLD = int(os.getenv("RSS_READER_FETCH_HOST_FAILURE_THRESHOLD", "5"))
+FAILURE_TRACKER_SIZE = 10000
+SINGLE_FLIGHT_TTL = float(os.getenv("RSS_READER_SINGLE_FLIGHT_TTL", str(FETCH_TIMEOUT * 3)))
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+USER_AGENT = "rss-reader (+https://github.com/scorphus/rss-reader)"
+
+Loaded = Optional[Dict[str, Any]]
+
+
+class FetchError(Exception):
+    """FetchError is raised when the document of a feed can't be fetched"""
+
+
+class FetchSkipped(FetchError):
+    """FetchSkipped is raised when the document of a feed is not fetched because the
+    feed, or its host, is backing off for `retry_after` more seconds"""
+
+    def __init__(self, url: str, retry_after: float):
+        super().__init__(url)
+        self.retry_after = retry_after
+
+
+class FetchStatus(enum.Enum):
+    """FetchStatus tells how the fetch of a feed document went"""
+
+    FETCHED = "fetched"
+    NOT_MODIFIED = "not_modified"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+@dataclass
+class Document:
+    """Document holds a fetched feed document along with its cache validators and the
+    fields of its channel collected while it was read
+
+    A skipped document tells, in `retry_after`, how many seconds are left before the
+    feed can be fetched again"""
+
+    content: bytes = b""
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+    status: FetchStatus = FetchStatus.FETCHED
+    channel: Dict[str, Any] = field(default_factory=dict)
+    truncated: bool = False
+    retry_after: float = 0.0
+
+
+@dataclass
+class FetchStats:
+    """FetchStats counts how conditional requests were answered: hits are documents
+    the origin reported as not modified, misses are documents sent in full"""
+
+    hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+
+
+@dataclass
+class Backoff:
+    """Backoff holds the consecutive failures of a URL or host, and until when it must
+    not be fetched again"""
+
+    failures: int = 0
+    retry_at: float = 0.0
+
+
+@dataclass
+class HostSlots:
+    """HostSlots holds the requests in flight to a host, and when the next one may
+    start"""
+
+    semaphore: asyncio.Semaphore
+    users: int = 0
+    next_start: float = 0.0
+
+    def idle(self, now: float) -> bool:
+        """Return whether no request to the host is in flight or due"""
+        return not self.users and self.next_start <= now
+
+
+class FailureTracker:
+    """FailureTracker counts consecutive failures by key, and blocks a key from the
+    `threshold`-th failure on for an exponentially growing time, up to `max_backoff`
+    seconds, until a fetch succeeds again
+
+    Once the time is up, the next fetch goes through as a trial, and the key is blocked
+    again until the trial is done. Up to `size` keys are tracked, evicting the least
+    recently failed ones first"""
+
+    def __init__(
+        self,
+        threshold: int = 1,
+        backoff: float = FAILURE_BACKOFF,
+        max_backoff: float = FAILURE_MAX_BACKOFF,
+        size: int = FAILURE_TRACKER_SIZE,
+    ):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.size = size
+        self.entries: OrderedDict[str, Backoff] = OrderedDict()
+
+    def blocked(self, key: str, now: float) -> bool:
+        """Return whether `key` must not be fetched yet"""
+        return self.retry_after(key, now) > 0
+
+    def retry_after(self, key: str, now: float) -> float:
+        """Return the number of seconds left before `key` can be fetched again"""
+        entry = self.entries.get(key)
+        return max(entry.retry_at - now, 0.0) if entry is not None else 0.0
+
+    def delay(self, failures: int) -> float:
+        """Return how long to back off after `failures` consecutive failures"""
+        return min(self.backoff * 2 ** (failures - self.threshold), self.max_backoff)
+
+    def trial(self, key: str, now: float) -> None:
+        """Block `key`, if it is done backing off, while a trial fetch is in flight"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.failures >= self.threshold:
+            entry.retry_at = now + self.delay(entry.failures)
+
+    def failure(self, key: str, now: float) -> None:
+        """Count a failure of `key`, backing off if it reached the threshold"""
+        entry = self.entries.setdefault(key, Backoff())
+        self.entries.move_to_end(key)
+        entry.failures += 1
+        if entry.failures >= self.threshold:
+            entry.retry_at = now + self.delay(entry.failures)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def success(self, key: str) -> None:
+        """Forget the failures of `key`"""
+        self.entries.pop(key, None)
+
+
+class HostLimiter:
+    """HostLimiter caps how many requests are in flight to each host, and spaces out
+    the start of requests to a host by `1 / rate` seconds
+
+    Idle hosts are forgotten once more than `size` are known. It must only be used
+    from the event loop of the process"""
+
+    def __init__(
+        self,
+        concurrency: int = FETCH_HOST_CONCURRENCY,
+        rate: float = FETCH_HOST_RATE,
+        size: int = FAILURE_TRACKER_SIZE,
+    ):
+        self.concurrency = concurrency
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.size = size
+        self.hosts: Dict[str, HostSlots] = {}
+
+    def prune(self, now: float) -> None:
+        """Forget the hosts that are neither requested nor waiting to be"""
+        for host in [host for host, slots in self.hosts.items() if slots.idle(now)]:
+            del self.hosts[host]
+
+    @asynccontextmanager
+    async def limit(self, host: str) -> AsyncIterator[None]:
+        """Wait for a slot to request `host`, and hold it until the request is done"""
+        if host not in self.hosts:
+            if len(self.hosts) >= self.size:
+                self.prune(time.monotonic())
+            self.hosts[host] = HostSlots(asyncio.Semaphore(self.concurrency))
+        slots = self.hosts[host]
+        slots.users += 1
+        try:
+            async with slots.semaphore:
+                now = time.monotonic()
+                start = max(now, slots.next_start)
+                slots.next_start = start + self.interval
+                if start > now:
+                    await asyncio.sleep(start - now)
+                yield
+        finally:
+            slots.users -= 1
+
+
+class Fetcher:  # pylint: disable=too-many-instance-attributes
+    """Fetcher downloads feed documents over a pooled HTTP client, with a timeout per
+    request and a cap on how many requests are in flight at once, overall and by host
+
+    URLs that fail, by not responding, responding with an error or with something
+    other than a feed, are not fetched again until they are done backing off, and
+    neither are any URLs of hosts that fail repeatedly. A skipped document is returned
+    for them right away instead.
+
+    Documents are read as they are downloaded, up to `max_bytes` bytes and
+    `max_entries` entries, so that huge or hostile feeds can't exhaust memory"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        timeout: float = FETCH_TIMEOUT,
+        concurrency: int = FETCH_CONCURRENCY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_bytes: int = FETCH_MAX_BYTES,
+        max_entries: int = parser.MAX_ENTRIES,
+    ):
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            transport=transport,
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = FetchStats()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.urls = FailureTracker()
+        self.hosts = FailureTracker(threshold=HOST_FAILURE_THRESHOLD)
+        self.limiter = HostLimiter()
+
+    async def read(self, url: str, response: httpx.Response) -> Document:
+        """Read the body of a response, stopping once the limits are reached"""
+        scanner = parser.FeedScanner(self.max_entries)
+        async for chunk in response.aiter_bytes():
+            scanner.feed(chunk[: self.max_bytes + 1 - len(scanner.content)])
+            if scanner.done or len(scanner.content) > self.max_bytes:
+                logger.warning("Truncated %s at %d entries", url, scanner.entries)
+                truncated = True
+                break
+        else:
+            truncated = False
+        return Document(
+            content=scanner.document(self.max_bytes),
+            etag=response.headers.get("ETag"),
+            modified=response.headers.get("Last-Modified"),
+            channel=scanner.channel_fields(),
+            truncated=truncated,
+        )
+
+    async def fetch(
+        self, url: str, etag: Optional[str] = None, modified: Optional[str] = None
+    ) -> Document:
+        """Fetch the document at `url`, returning a failed document if it can't be fetched,
+        and a skipped one if it, or its host, is backing off
+
+        The `etag` and `modified` validators of a previous fetch, when given, make the
+        request conditional so that an unchanged document is not downloaded again"""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+        host = urllib.parse.urlsplit(url).hostname or ""
+        now = time.monotonic()
+        retry_after = max(self.urls.retry_after(url, now), self.hosts.retry_after(host, now))
+        if retry_after:
+            self.stats.skipped += 1
+            return Document(status=FetchStatus.SKIPPED, retry_after=retry_after)
+        # let a single trial through once done backing off, until it succeeds or fails
+        self.urls.trial(url, now)
+        self.hosts.trial(host, now)
+        async with self.limiter.limit(host), self.semaphore:
+            try:
+                with metrics.FETCH_LATENCY.labels("network").time():
+                    async with self.client.stream("GET", url, headers=headers) as response:
+                        if headers and response.status_code == 304:
+                            self.stats.hits += 1
+                            self.succeeded(url, host)
+                            return Document(
+                                etag=etag, modified=modified, status=FetchStatus.NOT_MODIFIED
+                            )
+                        if response.is_error:
+                            logger.warning("Failed to fetch %s: %s", url, response.status_code)
+                            self.failed(url, host if response.is_server_error else None)
+                            return Document(status=FetchStatus.FAILED)
+                        document = await self.read(url, response)
+            except httpx.HTTPError as err:
+                logger.warning("Failed to fetch %s: %r", url, err)
+                self.failed(url, host)
+                return Document(status=FetchStatus.FAILED)
+        self.succeeded(url, host)
+        if headers:
+            self.stats.misses += 1
+        return document
+
+    def succeeded(self, url: str, host: str) -> None:
+        """Forget the failures of a URL and its host"""
+        self.urls.success(url)
+        self.hosts.success(host)
+
+    def failed(self, url: str, host: Optional[str] = None) -> None:
+        """Count a failure of a URL, and of its host if it is to blame"""
+        now = time.monotonic()
+        self.urls.failure(url, now)
+        if host is not None:
+            self.hosts.failure(host, now)
+
+    async def close(self) -> None:
+        """Close the underlying HTTP client and its connections"""
+        await self.client.aclose()
+
+
+class SingleFlight:
+    """SingleFlight runs one call at a time per key, sharing its outcome with the calls
+    made for the same key while it is in flight
+
+    It must only be used from the event loop of the process"""
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Loaded]]) -> Loaded:
+        """Return the outcome of `call`, or of the call in flight for `key`"""
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.lead(key, call))
+            self.calls[key] = future
+            future.add_done_callback(functools.partial(self.land, key))
+        else:
+            self.coalesced += 1
+        # shielded so that a cancelled caller doesn't cancel the call of the others
+        return await asyncio.shield(future)
+
+    def land(self, key: str, future: asyncio.Future) -> None:
+        """Forget the call for `key` once it has finished"""
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+    async def lead(  # pylint: disable=unused-argument
+        self, key: str, call: Callable[[], Awaitable[Loaded]]
+    ) -> Loaded:
+        """Make the call for `key` on behalf of all the callers"""
+        return await call()
+
+
+class RedisSingleFlight(SingleFlight):
+    """RedisSingleFlight also shares calls among workers: the worker that takes the
+    lock of a key makes the call and publishes its outcome, which the other workers
+    wait for
+
+    Workers make the call themselves if Redis fails, or if the outcome isn't
+    published before the lock expires"""
+
+    prefix = "rss-reader:flight:"
+
+    def __init__(self, redis_url: str, ttl: float = SINGLE_FLIGHT_TTL):
+        super().__init__()
+        self.redis = redis.Redis.from_url(redis_url)
+        self.ttl = ttl
+
+    async def lead(self, key: str, call: Callable[[], Awaitable[Loaded]]) -> Loaded:
+        lock, result, ttl = f"{self.prefix}lock:{key}", f"{self.prefix}result:{key}", self.ttl
+        try:
+            locked = bool(await self.redis.set(lock, 1, nx=True, px=int(ttl * 1000)))
+            if not locked and (published := await self.wait(lock, result)) is not None:
+                self.coalesced += 1
+                return decode_loaded(published)
+        except redis.RedisError as err:
+            logger.warning("Failed to coalesce %s through Redis: %r", key, err)
+            return await call()
+        try:
+            loaded = await call()
+            if locked:
+                await self.redis.set(result, encode_loaded(loaded), px=int(ttl * 1000))
+            return loaded
+        except redis.RedisError as err:
+            logger.warning("Failed to publish %s to Redis: %r", key, err)
+            return loaded
+        finally:
+            if locked:
+                await self.release(lock)
+
+    async def wait(self, lock: str, result: str) -> Optional[Union[bytes, str]]:
+        """Wait for the outcome published by the worker holding the lock, returning
+        None if the lock is released or expires without it"""
+        while True:
+            if (published := await self.redis.get(result)) is not None:
+                return published
+            if not await self.redis.exists(lock):
+                return await self.redis.get(result)
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+    async def release(self, lock: str) -> None:
+        """Release a lock, logging failures, since it expires anyway"""
+        try:
+            await self.redis.delete(lock)
+        except redis.RedisError as err:
+            logger.warning("Failed to release %s: %r", lock, err)
+
+
+def encode_loaded(loaded: Loaded) -> str:
+    """Encode the fields of a loaded feed and its posts as JSON"""
+    return json.dumps({"loaded": loaded}, default=datetime.isoformat)
+
+
+def decode_loaded(encoded: Union[bytes, str]) -> Loaded:
+    """Decode the fields of a loaded feed and its posts from JSON"""
+    loaded = json.loads(encoded)["loaded"]
+    if loaded is not None:
+        loaded["updated"] = loaded["updated"] and datetime.fromisoformat(loaded["updated"])
+        for post in loaded["posts"]:
+            post["published"] = post["published"] and datetime.fromisoformat(post["published"])
+    return loaded
+
+
+@functools.cache
+def get_single_flight(redis_url: Optional[str] = cache.REDIS_URL) -> SingleFlight:
+    """Return the single-flight layer shared by the whole process, spanning workers
+    through Redis if `redis_url` is given"""
+    if redis_url:
+        return RedisSingleFlight(redis_url)
+    return SingleFlight()
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so that equivalent ones are fetched once: lowercase scheme and
+    host, without default port or fragment"""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme, host = parts.scheme.lower(), (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in {("http", 80), ("https", 443)}:
+        host = f"{host}:{parts.port}"
+    if parts.username or parts.password:
+        host = f"{parts.netloc.rpartition('@')[0]}@{host}"
+    return urllib.parse.urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+def flight_key(url: str, etag: Optional[str], modified: Optional[str]) -> str:
+    """Return the single-flight key of a fetch, which depends on its validators too"""
+    key = "\n".join((normalize_url(url), etag or "", modified or ""))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@functools.cache
+def get_fetcher() -> Fetcher:
+    """Return the fetcher shared by the whole process"""
+    logger.debug("Creating fetcher with timeout %s", FETCH_TIMEOUT)
+    return Fetcher()
+
+
+async def close() -> None:
+    """Close the shared fetcher and parse processes, if they were ever created"""
+    if get_fetcher.cache_info().currsize:
+        await get_fetcher().close()
+        get_fetcher.cache_clear()
+    parser.shutdown()
+
+
+def stats() -> Dict[str, int]:
+    """Return the conditional request statistics of the shared fetcher, along with how
+    many fetches were coalesced with one in flight"""
+    return dict(asdict(get_fetcher().stats), coalesced=get_single_flight().coalesced)
+
+
+async def fetch(url: str, etag: Optional[str] = None, modified: Optional[str] = None) -> Document:
+    """Fetch the document at `url` with the shared fetcher"""
+    return await get_fetcher().fetch(url, etag=etag, modified=modified)
+
+
+async def load(url: str, etag: Optional[str], modified: Optional[str]) -> Loaded:
+    """Fetch and parse the document at `url`, returning the fields of the feed and of
+    its posts, or None if it has not been modified, and raising FetchError if it can't
+    be fetched, FetchSkipped if its fetch is skipped"""
+    document = await fetch(url, etag=etag, modified=modified)
+    if document.status is FetchStatus.SKIPPED:
+        raise FetchSkipped(url, document.retry_after)
+    if document.status is FetchStatus.FAILED:
+        raise FetchError(url)
+    if document.status is FetchStatus.NOT_MODIFIED:
+        return None
+    with metrics.FETCH_LATENCY.labels("parse").time():
+        parsed = await parser.parse_async(document.content, document.channel)
+    if document.content and not parsed.pop("version"):
+        logger.warning("Not a feed: %s", url)
+        get_fetcher().failed(url)
+    parsed.update(etag=document.etag, modified=document.modified)
+    return parsed
+
 
+async def replenish(feed: Feed) -> Optional[List[Dict[str, Any]]]:
+    """Replenish the feed with missing attributes, returning the fields of its posts
 
-def replenish(feed: Feed) -> None:
-    """Replenish the feed with missing attributes"""
-    parsed = feedparser.parse(feed.url)
-    feed.title = parsed.feed.get("title", "No title (or not a RSS feed)")
-    feed.subtitle = parsed.feed.get("subtitle", "No subtitle")
-    feed.updated = parsed.feed.get("updated", None)
+    The feed is left untouched, and None is returned, when the origin reports it has
+    not been modified since it was last fetched. It's left untouched too when it can't
+    be fetched, and FetchError is raised. Concurrent replenishments of the same URL
+    share one fetch"""
+    key = flight_key(feed.url, feed.etag, feed.modified)
+    call = functools.partial(load, feed.url, feed.etag, feed.modified)
+    loaded = await get_single_flight().do(key, call)
+    if loaded is None:
+        return None
+    feed.etag = loaded["etag"]
+    feed.modified = loaded["modified"]
+    feed.title = loaded["title"]
+    feed.subtitle = loaded["subtitle"]
+    feed.updated = loaded["updated"]
+    return [dict(post) for post in loaded["posts"]]
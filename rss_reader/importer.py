@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Bulk import of feeds from OPML documents or lists of URLs
+
+URLs are imported in batches of `IMPORT_BATCH_SIZE`: the feeds of a batch are fetched
+concurrently, bounded by the fetcher's concurrency cap, and then written along with
+their posts in batched statements."""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional
+from xml.etree import ElementTree
+
+import pydantic
+from sqlmodel import SQLModel
+
+from rss_reader import aiodb, db, feedsvc, scheduler
+from rss_reader.logger import logger
+
+
+IMPORT_BATCH_SIZE = int(os.getenv("RSS_READER_IMPORT_BATCH_SIZE", "100"))
+
+
+class ImportResult(SQLModel):
+    """ImportResult defines the outcome of importing a feed URL"""
+
+    url: str
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+def parse_feed_list(content: bytes) -> List[str]:
+    """Parse feed URLs out of an OPML document, a JSON array or one URL per line"""
+    text = content.decode("utf-8-sig").strip()
+    if text.startswith("<"):
+        try:
+            root = ElementTree.fromstring(text)
+        except ElementTree.ParseError as err:
+            raise ValueError(f"Invalid OPML document: {err}") from err
+        outlines = root.iter("outline")
+        return [outline.attrib["xmlUrl"] for outline in outlines if "xmlUrl" in outline.attrib]
+    if text.startswith("["):
+        try:
+            urls = json.loads(text)
+        except json.JSONDecodeError as err:
+            raise ValueError(f"Invalid JSON array: {err}") from err
+        if not all(isinstance(url, str) for url in urls):
+            raise ValueError("Invalid JSON array: must contain only URLs")
+        return urls
+    lines = (line.strip() for line in text.splitlines())
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+async def replenish(feed: db.Feed) -> List[Dict[str, Any]]:
+    """Replenish a feed about to be imported, returning the fields of its posts"""
+    try:
+        posts = await feedsvc.replenish(feed) or []
+    except feedsvc.FetchError:
+        posts = []
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to replenish %r", feed)
+        posts = []
+    scheduler.reschedule(feed, changed=True)
+    return posts
+
+
+async def import_batch(session: db.AsyncSession, urls: List[str]) -> Dict[str, ImportResult]:
+    """Import a batch of valid, distinct URLs"""
+    existing = await aiodb.get_feed_ids(session, urls)
+    results = {url: ImportResult(url=url, status="exists", id=existing[url]) for url in existing}
+    feeds = [db.Feed(url=url) for url in urls if url not in existing]
+    # end the transaction, so that no connection is held while the feeds are fetched
+    await session.commit()
+    posts = await asyncio.gather(*(replenish(feed) for feed in feeds))
+    ids = await aiodb.add_feeds(session, feeds)
+    for feed in feeds:
+        status = "created" if feed.url in ids else "exists"
+        results[feed.url] = ImportResult(url=feed.url, status=status, id=ids.get(feed.url))
+    await aiodb.upsert_posts(
+        session,
+        [
+            dict(post, feed_id=ids[feed.url])
+            for feed, feed_posts in zip(feeds, posts)
+            if feed.url in ids
+            for post in feed_posts
+        ],
+    )
+    return results
+
+
+async def import_feeds(session: db.AsyncSession, urls: List[str]) -> List[ImportResult]:
+    """Import feeds by URL, returning the outcome for each URL in the order given"""
+    results: Dict[str, ImportResult] = {}
+    valid: List[str] = []
+    for url in dict.fromkeys(urls):
+        try:
+            valid.append(db.FeedBase(url=url).url)
+        except pydantic.ValidationError as err:
+            detail = err.errors()[0]["msg"]
+            results[url] = ImportResult(url=url, status="invalid", detail=detail)
+    for start in range(0, len(valid), IMPORT_BATCH_SIZE):
+        end = start + IMPORT_BATCH_SIZE
+        results.update(await import_batch(session, valid[start:end]))
+    return [results[url] for url in urls]
@@ -8,10 +8,21 @@
 # https://opensource.org/licenses/BSD-3-Clause
 # Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
-"""logger defines the logger for the application"""
+"""logger defines the logger for the application
 
+Log calls never wait on I/O: records are put on a bounded queue and shipped to the
+actual handlers (stderr, Logtail) in batches, from a background thread. When the
+queue fills up, records below WARNING are sampled and, if it's full, dropped, and
+the number of records dropped is logged once they can be shipped again."""
+
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import threading
+from typing import List, Optional, Sequence
 
 
 try:
@@ -20,12 +31,168 @@ except ImportError:
     logtail = None
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR")
+LOG_SQL = os.getenv("RSS_READER_LOG_SQL", "false").lower() in {"1", "true", "yes"}
+LOG_QUEUE_SIZE = int(os.getenv("RSS_READER_LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("RSS_READER_LOG_BATCH_SIZE", "100"))
+LOG_SAMPLE_RATE = float(os.getenv("RSS_READER_LOG_SAMPLE_RATE", "0.1"))
+LOG_HIGH_WATER = 0.8
+LOG_FORMAT = "%(asctime)s %(levelname)-8s %(message)s"
 LOGTAIL_HANDLER_SOURCE_TOKEN = os.getenv("LOGTAIL_HANDLER_SOURCE_TOKEN", None)
 
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """BoundedQueueHandler puts records on a bounded queue without ever blocking
+
+    Once the queue is filled past `high_water`, records below WARNING are kept at
+    `sample_rate`; records that don't fit are dropped. Both are counted as dropped"""
+
+    def __init__(
+        self,
+        log_queue: "queue.Queue[Optional[logging.LogRecord]]",
+        sample_rate: float = LOG_SAMPLE_RATE,
+        high_water: float = LOG_HIGH_WATER,
+    ):
+        super().__init__(log_queue)
+        self.queue: "queue.Queue[Optional[logging.LogRecord]]" = log_queue
+        self.sample_rate = sample_rate
+        self.high_water = int(log_queue.maxsize * high_water)
+        self.dropped = 0
+
+    def shed(self, record: logging.LogRecord) -> bool:
+        """Return whether a record must be dropped to relieve the queue"""
+        return (
+            record.levelno < logging.WARNING
+            and self.queue.qsize() >= self.high_water
+            and random.random() >= self.sample_rate
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.shed(record):
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handleError(record)
+
+    def take_dropped(self) -> int:
+        """Return the number of records dropped since the last call"""
+        with self.lock:  # type: ignore[union-attr]
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """BatchStreamHandler writes records without flushing, which is left to the end
+    of each batch"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handleError(record)
+
+
+class LogShipper:
+    """LogShipper ships the records queued by `source` to `handlers` from a
+    background thread, in batches of up to `batch_size` records, flushing the
+    handlers once per batch"""
+
+    def __init__(
+        self,
+        source: BoundedQueueHandler,
+        handlers: Sequence[logging.Handler],
+        batch_size: int = LOG_BATCH_SIZE,
+    ):
+        self.source = source
+        self.handlers = list(handlers)
+        self.batch_size = batch_size
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start shipping records"""
+        self.thread = threading.Thread(
+            target=self.run, args=(self.source.queue,), name="log-shipper", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Ship the records queued so far and stop"""
+        if self.thread is not None and self.thread.is_alive():
+            self.source.queue.put(None)
+            self.thread.join()
+        self.thread = None
+
+    def restart(self) -> None:
+        """Start shipping records again with a new queue, in a forked process whose
+        thread did not survive the fork"""
+        self.source.queue = queue.Queue(self.source.queue.maxsize)
+        self.start()
+
+    def next_batch(self, log_queue: "queue.Queue[Optional[logging.LogRecord]]") -> List:
+        """Wait for a record and return it along with those queued after it"""
+        batch = [log_queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self, log_queue: "queue.Queue[Optional[logging.LogRecord]]") -> None:
+        """Ship batches of records until stopped"""
+        while True:
+            batch = self.next_batch(log_queue)
+            self.ship([record for record in batch if record is not None])
+            if None in batch:
+                return
+
+    def ship(self, records: List[logging.LogRecord]) -> None:
+        """Hand records over to the handlers and flush them"""
+        if dropped := self.source.take_dropped():
+            records.append(
+                logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"Dropped {dropped} log records",
+                    }
+                )
+            )
+        for handler in self.handlers:
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            try:
+                handler.flush()
+            except (OSError, ValueError):
+                pass
+
+
 logging_level = getattr(logging, LOG_LEVEL, logging.ERROR)
-logging.basicConfig(level=logging_level, format="%(asctime)s %(levelname)-8s %(message)s")
 logger = logging.getLogger(__name__)
 logger.setLevel(logging_level)
 
+stream_handler = BatchStreamHandler()
+stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+log_handlers: List[logging.Handler] = [stream_handler]
 if logtail and LOGTAIL_HANDLER_SOURCE_TOKEN:
-    logger.addHandler(logtail.LogtailHandler(source_token=LOGTAIL_HANDLER_SOURCE_TOKEN))
+    logtail_handler = logtail.LogtailHandler(source_token=LOGTAIL_HANDLER_SOURCE_TOKEN)
+    logtail_handler.addFilter(logging.Filter(__name__))
+    log_handlers.append(logtail_handler)
+
+queue_handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+shipper = LogShipper(queue_handler, log_handlers)
+shipper.start()
+atexit.register(shipper.stop)
+os.register_at_fork(after_in_child=shipper.restart)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging_level)
+root_logger.addHandler(queue_handler)
+
+if LOG_SQL:
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
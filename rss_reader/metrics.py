@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Prometheus metrics of requests, database statements and feed fetches
+
+Metrics are kept in the default registry of the process. When several workers serve
+the API, set `PROMETHEUS_MULTIPROC_DIR` to a directory shared by them so that
+`/metrics` aggregates the metrics of all of them."""
+
+import os
+import time
+from typing import Any, Dict, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", None)
+
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+UNMATCHED = "unmatched"
+
+REQUEST_LATENCY = Histogram(
+    "rss_reader_request_duration_seconds",
+    "Latency of API requests",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "rss_reader_requests_in_flight",
+    "API requests being served",
+    multiprocess_mode="livesum",
+)
+DB_LATENCY = Histogram(
+    "rss_reader_db_statement_duration_seconds",
+    "Latency of database statements",
+    ["statement"],
+    buckets=DB_BUCKETS,
+)
+FETCH_LATENCY = Histogram(
+    "rss_reader_fetch_duration_seconds",
+    "Latency of feed fetches, split into the network and parse phases",
+    ["phase"],
+)
+
+
+def statement_kind(statement: str) -> str:
+    """Return the kind of a SQL statement, its first keyword, keeping the label set
+    small"""
+    keyword, _, _ = statement.lstrip().partition(" ")
+    return keyword.upper() or "UNKNOWN"
+
+
+def before_cursor_execute(conn: Any, *_: Any) -> None:
+    """Note when a statement starts executing on the connection"""
+    conn.info.setdefault("statement_started_at", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn: Any, _: Any, statement: str, *__: Any) -> None:
+    """Observe how long the statement that just finished executing took"""
+    started_at = conn.info["statement_started_at"].pop()
+    DB_LATENCY.labels(statement_kind(statement)).observe(time.perf_counter() - started_at)
+
+
+def handle_error(context: Any) -> None:
+    """Forget when a failed statement started, as it never finishes executing"""
+    if context.connection is not None and context.connection.info.get("statement_started_at"):
+        context.connection.info["statement_started_at"].pop()
+
+
+def instrument_engine(engine: Any) -> None:
+    """Time the statements executed by a (sync) SQLAlchemy engine"""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def route_of(scope: Dict[str, Any]) -> str:
+    """Return the path template of the route that served a request, which keeps the
+    label set bounded, unlike the path itself"""
+    endpoint = scope.get("endpoint")
+    for route in scope["app"].routes:
+        if getattr(route, "endpoint", None) is endpoint is not None:
+            return route.path
+    return UNMATCHED
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """MetricsMiddleware measures the latency of HTTP requests by method, route and
+    status, and counts those being served"""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started_at = time.perf_counter()
+        try:
+            with REQUESTS_IN_FLIGHT.track_inprogress():
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            labels = scope["method"], route_of(scope), str(status)
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - started_at)
+
+
+def exposition() -> Tuple[bytes, str]:
+    """Return the metrics in the Prometheus text format, along with its content type"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
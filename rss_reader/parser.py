@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Parsing of feed documents in a pool of worker processes
+
+feedparser is pure Python and CPU-bound, so parsing a large document in the event
+loop, or in a thread, holds the GIL and stalls every other request of the worker.
+Documents are parsed in `RSS_READER_PARSE_WORKERS` processes instead (`0` parses
+them in the calling process): raw bytes go in, plain dicts come out. Each worker of
+the API has a pool of its own, hence the small default.
+
+Documents are scanned as they are downloaded, so that reading them stops at
+`RSS_READER_FETCH_MAX_ENTRIES` entries, and the fields of the channel are collected
+without building the document in memory.
+
+This module is imported by the worker processes, so it must stay light."""
+
+import asyncio
+import email.utils
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from xml.parsers import expat
+from xml.sax import saxutils
+
+import feedparser
+
+
+PARSE_WORKERS = int(os.getenv("RSS_READER_PARSE_WORKERS", "2"))
+MAX_ENTRIES = int(os.getenv("RSS_READER_FETCH_MAX_ENTRIES", "1000"))
+
+CHANNEL_TAGS = {"channel", "feed"}
+ENTRY_TAGS = {"item", "entry"}
+CHANNEL_FIELDS = {
+    "title": "title",
+    "subtitle": "subtitle",
+    "description": "subtitle",
+    "tagline": "subtitle",
+    "updated": "updated",
+    "modified": "updated",
+    "lastBuildDate": "updated",
+    "pubDate": "updated",
+    "date": "updated",
+}
+
+
+def to_datetime(value: Optional[time.struct_time]) -> Optional[datetime]:
+    """Convert a time parsed by feedparser, which is always in UTC, to a datetime"""
+    return datetime(*value[:6]) if value else None
+
+
+def to_post(entry: feedparser.FeedParserDict) -> Dict[str, Any]:
+    """Convert an entry parsed by feedparser to the fields of a post"""
+    return {
+        "post_id": entry.get("id") or entry.get("link"),
+        "title": entry.get("title"),
+        "link": entry.get("link"),
+        "summary": entry.get("summary"),
+        "published": to_datetime(entry.get("published_parsed") or entry.get("updated_parsed")),
+    }
+
+
+def parse(content: bytes, channel: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Parse a feed document into the fields of the feed and of its posts, along with
+    its format, which is empty if it's not a feed
+
+    The fields of the feed feedparser doesn't find, which a truncated document may
+    lack, are taken from the `channel` fields scanned from the whole document"""
+    parsed = feedparser.parse(content)
+    missing = {
+        field: value for field, value in (channel or {}).items() if not parsed.feed.get(field)
+    }
+    fallback = sanitize_channel(missing) if missing else {}
+    return {
+        "title": parsed.feed.get("title", fallback.get("title", "No title (or not a RSS feed)")),
+        "subtitle": parsed.feed.get("subtitle", fallback.get("subtitle", "No subtitle")),
+        "updated": to_datetime(parsed.feed.get("updated_parsed")) or fallback.get("updated"),
+        "version": parsed.get("version", ""),
+        "posts": [post for post in map(to_post, parsed.entries) if post["post_id"]],
+    }
+
+
+def sanitize_channel(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the scanned fields of a channel with their text sanitized like
+    feedparser sanitizes that of a document, by parsing them as a channel of their own"""
+    elements = {"title": "title", "subtitle": "description"}
+    text = "".join(
+        f"<{tag}>{saxutils.escape(fields[field])}</{tag}>"
+        for field, tag in elements.items()
+        if field in fields
+    )
+    feed = feedparser.parse(f'<rss version="2.0"><channel>{text}</channel></rss>').feed
+    return dict(fields, **{field: feed.get(field, "") for field in elements if field in fields})
+
+
+def local_name(tag: str) -> str:
+    """Return the name of a tag without its namespace prefix"""
+    return tag.rpartition(":")[2]
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """Parse an RFC 3339 (Atom) or RFC 822 (RSS) date to a naive datetime in UTC"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class FeedScanner:  # pylint: disable=too-many-instance-attributes
+    """FeedScanner reads a feed document incrementally, counting its complete entries
+    and collecting the fields of its channel as they go by, so that reading can stop
+    at `max_entries` entries
+
+    Documents that aren't well-formed XML are read to the end, unscanned"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.content = bytearray()
+        self.channel: Dict[str, str] = {}
+        self.entries = 0
+        self.end = 0
+        self.ancestors: List[str] = []
+        self.stack: List[str] = []
+        self.text: Optional[List[str]] = None
+        self.valid = True
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.characters
+
+    @property
+    def done(self) -> bool:
+        """Whether `max_entries` complete entries were read"""
+        return self.entries >= self.max_entries
+
+    def in_channel(self) -> bool:
+        """Return whether the current element is a direct child of the channel"""
+        return len(self.stack) > 1 and local_name(self.stack[-2]) in CHANNEL_TAGS
+
+    def start(self, tag: str, _: Dict[str, str]) -> None:
+        """Start collecting the text of a field of the channel"""
+        self.stack.append(tag)
+        field = CHANNEL_FIELDS.get(local_name(tag))
+        if field is not None and field not in self.channel and self.in_channel():
+            self.text = []
+
+    def characters(self, data: str) -> None:
+        """Collect the text of a field of the channel"""
+        if self.text is not None:
+            self.text.append(data)
+
+    def end_element(self, tag: str) -> None:
+        """Store a field of the channel, or count an entry along with the offset of
+        its end"""
+        if self.text is not None and self.in_channel():
+            self.channel.setdefault(CHANNEL_FIELDS[local_name(tag)], "".join(self.text).strip())
+        self.text = None
+        self.stack.pop()
+        if local_name(tag) in ENTRY_TAGS and not self.done:
+            self.entries += 1
+            self.end = self.content.index(b">", self.parser.CurrentByteIndex) + 1
+            self.ancestors = list(self.stack)
+
+    def feed(self, chunk: bytes) -> None:
+        """Read the next chunk of the document"""
+        self.content += chunk
+        if self.valid and not self.done:
+            try:
+                self.parser.Parse(chunk, False)
+            except expat.ExpatError:
+                self.valid = False
+
+    def document(self, max_bytes: int) -> bytes:
+        """Return the document read, cut right after its last complete entry, and
+        closed, if reading stopped early"""
+        if not self.done and len(self.content) <= max_bytes:
+            return bytes(self.content)
+        if not self.valid or not self.entries:
+            return bytes(self.content[:max_bytes])
+        closing = "".join(f"</{tag}>" for tag in reversed(self.ancestors))
+        return bytes(self.content[: self.end]) + closing.encode()
+
+    def channel_fields(self) -> Dict[str, Any]:
+        """Return the fields of the channel collected, as fields of a feed"""
+        fields: Dict[str, Any] = {}
+        if self.channel.get("title"):
+            fields["title"] = self.channel["title"]
+        if self.channel.get("subtitle"):
+            fields["subtitle"] = self.channel["subtitle"]
+        if self.channel.get("updated") and (updated := parse_date(self.channel["updated"])):
+            fields["updated"] = updated
+        return fields
+
+
+@functools.cache
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """Return the pool of parse processes shared by the whole process, if any
+
+    Workers are spawned rather than forked, as forking a process that runs threads
+    (the event loop's executor, database drivers) is unsafe"""
+    if PARSE_WORKERS <= 0:
+        return None
+    return ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def parse_async(content: bytes, channel: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Parse a feed document in the pool of parse processes
+
+    A pool broken by a dead process, killed for running out of memory for instance,
+    is replaced for the following documents, and the documents it was parsing are
+    parsed in the calling process instead"""
+    executor = get_executor()
+    if executor is None:
+        return parse(content, channel)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, parse, content, channel)
+    except BrokenProcessPool:
+        if get_executor() is executor:
+            shutdown()
+        return parse(content, channel)
+
+
+def shutdown() -> None:
+    """Shut the pool of parse processes down, if it was ever created"""
+    if get_executor.cache_info().currsize:
+        if (executor := get_executor()) is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        get_executor.cache_clear()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""On-demand profiling of API requests with the pyinstrument statistical profiler
+
+A request is profiled when it carries the `X-Profile` header with the value of
+`RSS_READER_PROFILE_TOKEN`, or at random, at `RSS_READER_PROFILE_SAMPLE_RATE`.
+Profiles are saved to `RSS_READER_PROFILE_DIR`, which workers may share, and the
+latest `RSS_READER_PROFILE_KEEP` of them are kept, readable only by requests that
+carry the token as a bearer token. The middleware is only installed when profiling
+is configured, so requests cost nothing otherwise."""
+
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from rss_reader.logger import logger
+
+
+try:
+    import pyinstrument
+    from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+    from pyinstrument.session import Session
+except ImportError:
+    pyinstrument = None  # type: ignore[assignment]
+
+PROFILE_TOKEN = os.getenv("RSS_READER_PROFILE_TOKEN", None)
+PROFILE_SAMPLE_RATE = float(os.getenv("RSS_READER_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("RSS_READER_PROFILE_INTERVAL", "0.001"))
+PROFILE_DIR = os.getenv(
+    "RSS_READER_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "rss-reader-profiles")
+)
+PROFILE_KEEP = int(os.getenv("RSS_READER_PROFILE_KEEP", "100"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+PROFILE_ID = re.compile(r"^\d+-[0-9a-f]{8}$")
+
+
+def enabled(
+    token: Optional[str] = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE
+) -> bool:
+    """Return whether requests may be profiled"""
+    return pyinstrument is not None and (bool(token) or sample_rate > 0)
+
+
+def authorized(authorization: Optional[str]) -> bool:
+    """Return whether the value of an `Authorization` header carries the profile token
+    as a bearer token"""
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if not PROFILE_TOKEN or scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(credentials.encode(), PROFILE_TOKEN.encode())
+
+
+def new_profile_id() -> str:
+    """Return a new profile id, which sorts by creation time"""
+    return f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+
+
+def profile_path(directory: str, profile_id: str) -> Optional[str]:
+    """Return the path of the file of a profile, or None if the id is not valid"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(directory, f"{profile_id}.json")
+
+
+def save(session: Any, directory: str, profile_id: str, keep: int) -> None:
+    """Save the session of a profile, removing the oldest profiles beyond `keep`"""
+    os.makedirs(directory, exist_ok=True)
+    session.save(profile_path(directory, profile_id))
+    for name in sorted(os.listdir(directory), reverse=True)[keep:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    """Return the id, target and duration of the saved profiles, latest first"""
+    try:
+        names = sorted(os.listdir(directory), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        profile_id, _ = os.path.splitext(name)
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as file:
+                session = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        profiles.append(
+            {
+                "id": profile_id,
+                "target": session["target_description"],
+                "start_time": session["start_time"],
+                "duration": session["duration"],
+            }
+        )
+    return profiles
+
+
+def render(profile_id: str, fmt: str = "html", directory: str = PROFILE_DIR) -> Optional[str]:
+    """Render a saved profile as an HTML flame graph or as speedscope JSON, returning
+    None if there is no such profile"""
+    path = profile_path(directory, profile_id)
+    if pyinstrument is None or path is None or not os.path.exists(path):
+        return None
+    renderer = SpeedscopeRenderer() if fmt == "speedscope" else HTMLRenderer()
+    return renderer.render(Session.load(path))
+
+
+class ProfilingMiddleware:
+    """ProfilingMiddleware profiles the HTTP requests that carry the authorized
+    `X-Profile` header, or a random sample of them, and responds with the id of the
+    profile in the `X-Profile-Id` header"""
+
+    def __init__(
+        self,
+        app: Any,
+        token: Optional[str] = PROFILE_TOKEN,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        directory: str = PROFILE_DIR,
+        keep: int = PROFILE_KEEP,
+    ):  # pylint: disable=too-many-arguments
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+
+    def wants_profile(self, scope: Dict[str, Any]) -> bool:
+        """Return whether the request must be profiled"""
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return random.random() < self.sample_rate
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        profile_id = new_profile_id()
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, profile_id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profiler = pyinstrument.Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start(target_description=f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session = profiler.stop()
+            try:
+                await asyncio.to_thread(save, session, self.directory, profile_id, self.keep)
+            except OSError as err:
+                logger.warning("Failed to save profile %s: %r", profile_id, err)
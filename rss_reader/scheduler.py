@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Scheduler that keeps stored feeds fresh by fetching them again when they are due
+
+Each feed has its own fetch interval, which shrinks when the feed gains new posts
+between fetches and grows when it doesn't, so busy feeds are polled more often than quiet or
+dead ones. Due feeds are picked through the index on `Feed.next_fetch_at`."""
+
+import asyncio
+import itertools
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from rss_reader import cache, db, feedsvc
+from rss_reader.logger import logger
+
+
+MIN_INTERVAL = int(os.getenv("RSS_READER_SCHEDULER_MIN_INTERVAL", "300"))
+MAX_INTERVAL = int(os.getenv("RSS_READER_SCHEDULER_MAX_INTERVAL", "86400"))
+DEFAULT_INTERVAL = int(os.getenv("RSS_READER_SCHEDULER_DEFAULT_INTERVAL", "3600"))
+BATCH_SIZE = int(os.getenv("RSS_READER_SCHEDULER_BATCH_SIZE", "100"))
+POLL_INTERVAL = float(os.getenv("RSS_READER_SCHEDULER_POLL_INTERVAL", "10"))
+
+SPEEDUP = 0.5
+SLOWDOWN = 1.5
+
+
+def reschedule(feed: db.Feed, changed: bool, now: Optional[datetime] = None) -> None:
+    """Adapt the fetch interval of the feed and schedule its next fetch"""
+    if feed.fetch_interval is None:
+        interval = DEFAULT_INTERVAL
+    else:
+        interval = int(feed.fetch_interval * (SPEEDUP if changed else SLOWDOWN))
+    feed.fetch_interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+    feed.next_fetch_at = (now or db.utcnow()) + timedelta(seconds=feed.fetch_interval)
+
+
+async def refresh(feed: db.Feed) -> List[Dict[str, Any]]:
+    """Fetch the feed again, returning the fields of its posts
+
+    A feed that has not been modified, or can't be fetched, is left untouched"""
+    posts = None
+    try:
+        posts = await feedsvc.replenish(feed)
+    except feedsvc.FetchError:
+        pass
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to refresh %r", feed)
+    return [dict(post, feed_id=feed.id) for post in posts or []]
+
+
+async def run_once(engine: db.Engine, batch_size: int = BATCH_SIZE) -> int:
+    """Refresh a batch of due feeds, returning how many were refreshed
+
+    Feeds are rescheduled according to whether they gained posts that were not stored
+    yet. Feeds deleted while the batch is fetched are skipped, along with their posts."""
+    now = db.utcnow()
+    # the session is closed before the feeds are fetched, so that no connection is held
+    with db.Session(engine) as session:
+        feeds = await asyncio.to_thread(db.get_due_feeds, session, now, batch_size)
+    if not feeds:
+        return 0
+    fetched = await asyncio.gather(*(refresh(feed) for feed in feeds))
+    with db.Session(engine) as session:
+        post_ids = [post["post_id"] for post in itertools.chain(*fetched)]
+        stored = await asyncio.to_thread(db.get_stored_post_ids, session, post_ids)
+        for feed, feed_posts in zip(feeds, fetched):
+            reschedule(feed, any(post["post_id"] not in stored for post in feed_posts), now)
+        ids = set(await asyncio.to_thread(db.update_feeds, session, feeds))
+        await cache.create_cache().delete(*(cache.feed_key(feed_id) for feed_id in ids))
+        posts = [post for post in itertools.chain(*fetched) if post["feed_id"] in ids]
+        await asyncio.to_thread(db.upsert_posts, session, posts)
+    logger.info("Refreshed %d feeds", len(feeds))
+    return len(feeds)
+
+
+async def run(
+    engine: db.Engine,
+    batch_size: int = BATCH_SIZE,
+    poll_interval: float = POLL_INTERVAL,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """Keep refreshing due feeds until `stop` is set, sleeping while none are due, or
+    after a batch fails"""
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        try:
+            refreshed = await run_once(engine, batch_size)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to refresh a batch of feeds")
+            refreshed = 0
+        if refreshed < batch_size:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Slow query log
+
+Statements that take `RSS_READER_SLOW_QUERY_THRESHOLD` seconds or longer are logged
+and aggregated by their normalized text, with literals, placeholders and lists of
+them collapsed, along with the shape of their parameters. With
+`RSS_READER_SLOW_QUERY_EXPLAIN`, the plan of each slow SELECT is captured once:
+`EXPLAIN (ANALYZE, BUFFERS)` on PostgreSQL, which runs the statement again inside a
+savepoint, and `EXPLAIN QUERY PLAN` on SQLite.
+
+Each worker keeps its own log, of up to `SLOW_QUERY_SIZE` statements."""
+
+import functools
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+from rss_reader.logger import logger
+from rss_reader.metrics import statement_kind
+
+
+SLOW_QUERY_THRESHOLD = float(os.getenv("RSS_READER_SLOW_QUERY_THRESHOLD", "0.1"))
+SLOW_QUERY_EXPLAIN = os.getenv("RSS_READER_SLOW_QUERY_EXPLAIN", "false").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+SLOW_QUERY_SIZE = 1000
+SHAPE_MAX_PARAMS = 10
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\$\d+|\?|(?<![:\w]):\w+|\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r"\(\s*\?(?:::\w+)?(?:\s*,\s*\?(?:::\w+)?)*\s*\)")
+ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+
+
+def normalize(statement: str) -> str:
+    """Return the text of a statement with its literals and placeholders replaced by
+    `?`, and lists of them, such as `IN` lists and `VALUES` rows, collapsed"""
+    normalized = LITERALS.sub("?", " ".join(statement.split()))
+    return ROWS.sub("(...), ...", LISTS.sub("(...)", normalized))
+
+
+def params_shape(parameters: Any, executemany: bool = False) -> str:
+    """Return the shape of the parameters of a statement: their names, if any, and
+    types, without their values"""
+    if executemany and parameters:
+        return f"{len(parameters)} x {params_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        if len(parameters) > SHAPE_MAX_PARAMS:
+            return f"{{{len(parameters)} params}}"
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if len(parameters) > SHAPE_MAX_PARAMS:
+            return f"({len(parameters)} params)"
+        return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+    return ""
+
+
+def explain(conn: Any, statement: str, parameters: Any) -> Optional[str]:
+    """Return the plan of a statement that just ran on a connection, or None if its
+    database can't explain it"""
+    postgres = conn.dialect.name == "postgresql"
+    if postgres:
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    elif conn.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        if postgres:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except conn.dialect.dbapi.Error:
+            if postgres:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            raise
+        if postgres:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    except conn.dialect.dbapi.Error as err:
+        logger.warning("Failed to explain slow query: %r", err)
+        return None
+    finally:
+        cursor.close()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+@dataclass
+class SlowQuery:
+    """SlowQuery aggregates the executions of a slow statement"""
+
+    statement: str
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    params: str = ""
+    plan: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the aggregate as a dict, with the mean duration"""
+        return dict(asdict(self), mean=self.total / self.calls)
+
+
+class SlowQueryLog:
+    """SlowQueryLog records the statements that take `threshold` seconds or longer,
+    keeping the `size` with the most total time"""
+
+    def __init__(
+        self,
+        threshold: float = SLOW_QUERY_THRESHOLD,
+        explain_plans: bool = SLOW_QUERY_EXPLAIN,
+        size: int = SLOW_QUERY_SIZE,
+    ):
+        self.threshold = threshold
+        self.explain_plans = explain_plans
+        self.size = size
+        self.queries: Dict[str, SlowQuery] = {}
+        self.lock = threading.Lock()
+
+    def before_cursor_execute(self, *args: Any) -> None:
+        """Note when a statement starts executing"""
+        context = args[4]
+        context.slow_query_started_at = time.perf_counter()
+
+    def after_cursor_execute(  # pylint: disable=too-many-arguments
+        self, conn: Any, _: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        """Record the statement that just finished executing, if it was slow"""
+        started_at = getattr(context, "slow_query_started_at", None)
+        if started_at is None:
+            return
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= self.threshold:
+            self.record(conn, statement, parameters, executemany, elapsed)
+
+    def record(  # pylint: disable=too-many-arguments
+        self, conn: Any, statement: str, parameters: Any, executemany: bool, elapsed: float
+    ) -> None:
+        """Add a slow execution of a statement to its aggregate, capturing its plan the
+        first time, if asked to"""
+        key = normalize(statement)
+        with self.lock:
+            query = self.queries.get(key)
+            if query is None:
+                if len(self.queries) >= self.size:
+                    del self.queries[min(self.queries, key=lambda k: self.queries[k].total)]
+                query = self.queries[key] = SlowQuery(key)
+            query.calls += 1
+            query.total += elapsed
+            query.max = max(query.max, elapsed)
+            query.params = params_shape(parameters, executemany)
+            wants_plan = (
+                self.explain_plans
+                and query.plan is None
+                and not executemany
+                and statement_kind(statement) == "SELECT"
+            )
+            if wants_plan:
+                query.plan = ""
+        logger.warning("Slow query (%.3f s): %s %s", elapsed, key, query.params)
+        if wants_plan:
+            query.plan = explain(conn, statement, parameters)
+
+    def top(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the `limit` slow statements with the most total time"""
+        with self.lock:
+            queries = sorted(self.queries.values(), key=lambda query: query.total, reverse=True)
+            return [query.as_dict() for query in queries[:limit]]
+
+    def instrument(self, engine: Any) -> None:
+        """Record the slow statements executed by a (sync) SQLAlchemy engine"""
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+
+@functools.cache
+def get_slow_query_log() -> SlowQueryLog:
+    """Return the slow query log shared by the whole process"""
+    return SlowQueryLog()
+
+
+def instrument_engine(engine: Any) -> None:
+    """Record the slow statements executed by a (sync) SQLAlchemy engine in the log
+    shared by the whole process"""
+    get_slow_query_log().instrument(engine)
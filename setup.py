@@ -30,6 +30,7 @@ tests_require = [
     "ipdb",
     "isort",
     "mypy",
+    "pyinstrument",
     "pylint",
     "pytest-cov",
     "pytest-env",
@@ -65,8 +66,13 @@ setup(
     author_email="scorphus@gmail.com",
     packages=find_packages(),
     install_requires=[
+        "aiosqlite",  # async SQLite database adapter (https://github.com/omnilib/aiosqlite)
+        "asyncpg",  # async PostgreSQL database adapter (https://github.com/MagicStack/asyncpg)
         "FastAPI",  # web framework for building APIs (https://github.com/tiangolo/fastapi)
         "Feedparser",  # RSS feed parser (https://github.com/kurtmckee/feedparser)
+        "HTTPX",  # async HTTP client used to fetch feeds (https://github.com/encode/httpx)
+        "orjson",  # fast JSON serialization (https://github.com/ijl/orjson)
+        "prometheus-client",  # Prometheus instrumentation (https://github.com/prometheus/client_python)
         "Psycopg2-binary",  # PostgreSQL database adapter (https://github.com/psycopg/psycopg2)
         "Redis[hiredis]",  # interface to the Redis key-value store (https://github.com/redis/redis-py)
         "SQLmodel",  # library for interacting with SQL databases (https://github.com/tiangolo/sqlmodel)
@@ -75,6 +81,7 @@ setup(
     extras_require={
         "tests": tests_require,
         "mypy": mypy_require,
+        "profiling": ["pyinstrument"],
     },
     entry_points={
         "console_scripts": [
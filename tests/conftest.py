@@ -11,10 +11,14 @@
 # pylint: disable=missing-function-docstring,missing-module-docstring
 # pylint: disable=redefined-outer-name,unused-argument
 
+import asyncio
 import os
 
 import pytest
+import sqlalchemy
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session
 
 from rss_reader import api, db
@@ -47,8 +51,18 @@ def session_fixture(engine: db.Engine):
         yield session
 
 
+@pytest.fixture(name="async_engine")
+def async_engine_fixture(engine: db.Engine):
+    # each request made by the test client runs in its own event loop, so connections
+    # can't be pooled across requests
+    async_engine = create_async_engine(db.async_database_url(DATABASE_URL), poolclass=NullPool)
+    if async_engine.dialect.name == "sqlite":
+        sqlalchemy.event.listen(async_engine.sync_engine, "connect", db.set_sqlite_pragmas)
+    return async_engine
+
+
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
-    api.app.dependency_overrides[api.get_session] = lambda: session
+def client_fixture(async_engine: db.AsyncEngine, mocker):
+    mocker.patch.object(api, "engine", async_engine)
+    asyncio.run(api.cache_backend.clear())
     yield TestClient(api.app)
-    api.app.dependency_overrides.clear()
@@ -11,11 +11,13 @@
 # pylint: disable=missing-function-docstring,missing-module-docstring
 # pylint: disable=redefined-outer-name,unused-argument
 
+from typing import Any, Dict
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
-from rss_reader import db
+from rss_reader import api, db
 
 
 @pytest.fixture(name="replenish_mock", autouse=True)
@@ -78,6 +80,27 @@ def test_create_user_dupe(client: TestClient):
     assert response.status_code == 409
 
 
+def test_create_users(session: Session, client: TestClient):
+    client.post("/users/", json={"username": "rose"})
+    usernames = ["martha", "rose", "amy", "martha"]
+    response = client.post("/users/batch", json=[{"username": name} for name in usernames])
+    assert response.status_code == 200
+    data = response.json()
+    assert [(result["username"], result["status"]) for result in data] == [
+        ("martha", "created"),
+        ("rose", "exists"),
+        ("amy", "created"),
+        ("martha", "exists"),
+    ]
+    users = [session.get(db.User, data[i]["id"]) for i in (0, 2)]
+    assert [user and user.username for user in users] == ["martha", "amy"]
+
+
+def test_create_users_invalid(client: TestClient):
+    response = client.post("/users/batch", json=[{"username": "clara"}, {"username": "c-3"}])
+    assert response.status_code == 422
+
+
 def test_read_users(reset_db: db.Engine, client: TestClient):
     client.post("/users/", json={"username": "user_1"})
     client.post("/users/", json={"username": "user_2"})
@@ -96,6 +119,29 @@ def test_read_users_empty_db(reset_db: db.Engine, client: TestClient):
     assert len(data) == 0
 
 
+def test_read_users_paginated(reset_db: db.Engine, client: TestClient):
+    for i in range(5):
+        client.post("/users/", json={"username": f"user_{i}"})
+    response = client.get("/users/", params={"limit": 2})
+    assert [user["username"] for user in response.json()] == ["user_0", "user_1"]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/users/", params={"limit": 2, "after": cursor})
+    assert [user["username"] for user in response.json()] == ["user_2", "user_3"]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/users/", params={"limit": 2, "after": cursor})
+    assert [user["username"] for user in response.json()] == ["user_4"]
+    assert "X-Next-Cursor" not in response.headers
+    response = client.get("/users/", params={"limit": 2, "offset": 2})
+    assert [user["username"] for user in response.json()] == ["user_2", "user_3"]
+
+
+@pytest.mark.parametrize("cursor", ["!", "abc", "MQ=x", "ü"])
+def test_read_users_invalid_cursor(cursor: str, client: TestClient):
+    response = client.get("/users/", params={"after": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
 def test_read_user(client: TestClient):
     client.post("/users/", json={"username": "dan"})
     response = client.get("/users/dan")
@@ -201,11 +247,14 @@ def test_create_feed_invalid(client: TestClient):
     assert response.status_code == 422
 
 
-def test_create_feed_dupe(client: TestClient):
+def test_create_feed_dupe(client: TestClient, replenish_mock):
     response = client.post("/feeds/", json={"url": "http://feed2.com"})
     assert response.status_code == 201
+    replenish_mock.reset_mock()
     response = client.post("/feeds/", json={"url": "http://feed2.com"})
     assert response.status_code == 409
+    assert response.json() == {"detail": "Feed already exists"}
+    replenish_mock.assert_not_called()
 
 
 def test_read_feeds(reset_db: db.Engine, client: TestClient):
@@ -226,6 +275,34 @@ def test_read_feeds_empty_db(reset_db: db.Engine, client: TestClient):
     assert len(data) == 0
 
 
+def test_read_feeds_paginated(reset_db: db.Engine, client: TestClient):
+    for i in range(3):
+        client.post("/feeds/", json={"url": f"http://feed{i}.com"})
+    response = client.get("/feeds/", params={"limit": 2})
+    assert [feed["url"] for feed in response.json()] == ["http://feed0.com", "http://feed1.com"]
+    response = client.get(
+        "/feeds/", params={"limit": 2, "after": response.headers["X-Next-Cursor"]}
+    )
+    assert [feed["url"] for feed in response.json()] == ["http://feed2.com"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.parametrize("path", ["/users/", "/feeds/"])
+def test_read_lists_fast_json(path: str, reset_db: db.Engine, client: TestClient, mocker):
+    for i in range(3):
+        client.post("/users/", json={"username": f"user_{i}"})
+        client.post("/feeds/", json={"url": f"http://feed{i}.com"})
+    params: Dict[str, Any] = {"limit": 2}
+    validated = client.get(path, params=params)
+    mocker.patch.object(api, "FAST_JSON", True)
+    fast = client.get(path, params=params)
+    assert fast.status_code == 200
+    assert fast.json() == validated.json()
+    assert fast.headers["X-Next-Cursor"] == validated.headers["X-Next-Cursor"]
+    params["after"] = fast.headers["X-Next-Cursor"]
+    assert len(client.get(path, params=params).json()) == 1
+
+
 def test_read_feed(client: TestClient):
     response = client.post("/feeds/", json={"url": "http://feed5.com"})
     data = response.json()
@@ -274,3 +351,11 @@ def test_delete_feed_no_feed_id_not_allowed(client: TestClient):
     response = client.delete("/feeds/")
     assert response.status_code == 405
     assert response.json() == {"detail": "Method Not Allowed"}
+
+
+def test_read_stats(client: TestClient):
+    response = client.get("/admin/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data) == {"fetcher", "cache", "pool"}
+    assert set(data["fetcher"]) == {"hits", "misses", "skipped", "coalesced"}
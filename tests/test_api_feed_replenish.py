@@ -11,25 +11,25 @@
 # pylint: disable=missing-function-docstring,missing-module-docstring
 # pylint: disable=redefined-outer-name,unused-argument
 
-import functools
 from unittest.mock import Mock
 
-import feedparser
 import pytest
+import sqlalchemy
 from fastapi.testclient import TestClient
+from sqlmodel import Session, select
 
+from rss_reader import db, feedsvc, scheduler
 
-@pytest.fixture(name="feedparser_mock")
-def feedparser_mock_fixture(request, mocker):
+
+@pytest.fixture(name="fetch_mock")
+def fetch_mock_fixture(request, mocker):
     fixture = request.param if hasattr(request, "param") else "programming.rss"
     with open(f"tests/fixtures/{fixture}", "rb") as file:
-        yield mocker.patch(
-            "rss_reader.feedsvc.feedparser.parse",
-            side_effect=functools.partial(feedparser.parse, file),
-        )
+        document = feedsvc.Document(content=file.read(), etag='"v1"', modified="Thu, 16 Nov 2023")
+    return mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
 
 
-def test_create_feed_replenished(client: TestClient, feedparser_mock: Mock):
+def test_create_feed_replenished(session: Session, client: TestClient, fetch_mock: Mock):
     url = "https://www.reddit.com/r/programming/.rss"
     response = client.post("/feeds/", json={"url": url})
     assert response.status_code == 201
@@ -38,11 +38,14 @@ def test_create_feed_replenished(client: TestClient, feedparser_mock: Mock):
     assert data["title"] == "programming"
     assert data["subtitle"] == "Computer Programming"
     assert data["updated"] == "2023-11-16T13:54:19"
-    feedparser_mock.assert_called_once_with(url)
+    assert data["fetch_interval"] == scheduler.DEFAULT_INTERVAL
+    fetch_mock.assert_awaited_once_with(url, etag=None, modified=None)
+    posts = session.exec(select(db.Post).where(db.Post.feed_id == data["id"])).all()
+    assert len(posts) == 26
 
 
-@pytest.mark.parametrize("feedparser_mock", ["not_a_feed.rss"], indirect=True)
-def test_create_feed_replenished_not_a_feed(client: TestClient, feedparser_mock: Mock):
+@pytest.mark.parametrize("fetch_mock", ["not_a_feed.rss"], indirect=True)
+def test_create_feed_replenished_not_a_feed(client: TestClient, fetch_mock: Mock):
     url = "https://some.url.com/"
     response = client.post("/feeds/", json={"url": url})
     assert response.status_code == 201
@@ -53,8 +56,8 @@ def test_create_feed_replenished_not_a_feed(client: TestClient, feedparser_mock:
     assert not data["updated"]
 
 
-@pytest.mark.parametrize("feedparser_mock", ["404_error.rss"], indirect=True)
-def test_create_feed_replenished_404_error(client: TestClient, feedparser_mock: Mock):
+@pytest.mark.parametrize("fetch_mock", ["404_error.rss"], indirect=True)
+def test_create_feed_replenished_404_error(client: TestClient, fetch_mock: Mock):
     url = "https://some.other.url.com/"
     response = client.post("/feeds/", json={"url": url})
     assert response.status_code == 201
@@ -63,3 +66,138 @@ def test_create_feed_replenished_404_error(client: TestClient, feedparser_mock:
     assert data["title"] == "No title (or not a RSS feed)"
     assert data["subtitle"] == "No subtitle"
     assert not data["updated"]
+
+
+def test_create_feed_replenished_deferred(client: TestClient, fetch_mock: Mock):
+    url = "https://www.reddit.com/r/programming/.rss?deferred"
+    response = client.post("/feeds/", params={"defer": True}, json={"url": url})
+    assert response.status_code == 201
+    data = response.json()
+    assert data["url"] == url
+    assert not data["title"]
+    fetch_mock.assert_awaited_once_with(url, etag=None, modified=None)
+    response = client.get(f"/feeds/{data['id']}")
+    data = response.json()
+    assert data["title"] == "programming"
+    assert data["subtitle"] == "Computer Programming"
+    assert data["updated"] == "2023-11-16T13:54:19"
+
+
+def test_refresh_feed(client: TestClient, fetch_mock: Mock, mocker):
+    url = "https://www.reddit.com/r/programming/.rss?refreshed"
+    response = client.post("/feeds/", json={"url": url})
+    feed_id = response.json()["id"]
+    fetch_mock.return_value = feedsvc.Document(content=b"<rss><channel><title>new</title></rss>")
+    update_feed = mocker.spy(db, "update_feed")
+    response = client.post(f"/feeds/{feed_id}/refresh")
+    assert response.status_code == 200
+    assert response.json()["title"] == "new"
+    fetch_mock.assert_awaited_with(url, etag='"v1"', modified="Thu, 16 Nov 2023")
+    update_feed.assert_called_once()
+
+
+def test_refresh_feed_not_modified(client: TestClient, fetch_mock: Mock, mocker):
+    url = "https://www.reddit.com/r/programming/.rss?not-modified"
+    response = client.post("/feeds/", json={"url": url})
+    feed_id = response.json()["id"]
+    fetch_mock.return_value = feedsvc.Document(status=feedsvc.FetchStatus.NOT_MODIFIED)
+    update_feed = mocker.spy(db, "update_feed")
+    response = client.post(f"/feeds/{feed_id}/refresh")
+    assert response.status_code == 200
+    assert response.json()["title"] == "programming"
+    update_feed.assert_not_called()
+
+
+def test_refresh_feed_failed(client: TestClient, fetch_mock: Mock, mocker):
+    url = "https://www.reddit.com/r/programming/.rss?failed"
+    feed_id = client.post("/feeds/", json={"url": url}).json()["id"]
+    fetch_mock.return_value = feedsvc.Document(status=feedsvc.FetchStatus.FAILED)
+    update_feed = mocker.spy(db, "update_feed")
+    response = client.post(f"/feeds/{feed_id}/refresh")
+    assert response.status_code == 502
+    update_feed.assert_not_called()
+    assert client.get(f"/feeds/{feed_id}").json()["title"] == "programming"
+
+
+def test_refresh_feed_skipped(client: TestClient, fetch_mock: Mock, mocker):
+    url = "https://www.reddit.com/r/programming/.rss?skipped"
+    feed_id = client.post("/feeds/", json={"url": url}).json()["id"]
+    fetch_mock.return_value = feedsvc.Document(
+        status=feedsvc.FetchStatus.SKIPPED, retry_after=41.5
+    )
+    update_feed = mocker.spy(db, "update_feed")
+    response = client.post(f"/feeds/{feed_id}/refresh")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "42"
+    update_feed.assert_not_called()
+    assert client.get(f"/feeds/{feed_id}").json()["title"] == "programming"
+
+
+def test_refresh_feed_deleted_while_fetching(
+    session: Session, client: TestClient, fetch_mock: Mock
+):
+    url = "https://www.reddit.com/r/programming/.rss?deleted"
+    feed_id = client.post("/feeds/", json={"url": url}).json()["id"]
+
+    def fetch(*args, **kwargs):
+        db.delete_feed(session, feed_id)
+        return fetch_mock.return_value
+
+    fetch_mock.side_effect = fetch
+    response = client.post(f"/feeds/{feed_id}/refresh")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Feed not found"}
+
+
+def test_create_feed_deleted_while_deferred(
+    session: Session, client: TestClient, fetch_mock: Mock
+):
+    def fetch(url, **kwargs):
+        db.delete_feed(session, db.get_feed_ids(session, [url])[url])
+        return fetch_mock.return_value
+
+    fetch_mock.side_effect = fetch
+    url = "https://www.reddit.com/r/programming/.rss?deleted-deferred"
+    response = client.post("/feeds/", params={"defer": True}, json={"url": url})
+    assert response.status_code == 201
+    assert client.get(f"/feeds/{response.json()['id']}").status_code == 404
+
+
+def test_refresh_feed_not_found(client: TestClient, fetch_mock: Mock):
+    response = client.post("/feeds/123/refresh")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Feed not found"}
+    fetch_mock.assert_not_awaited()
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/feeds/", {"url": "https://feeds.com/fetched?connection"}),
+        ("/feeds/import", ["https://feeds.com/imported?connection"]),
+        ("/feeds/{feed_id}/refresh", None),
+    ],
+)
+def test_no_connection_held_while_fetching(
+    path: str, body, async_engine: db.AsyncEngine, client: TestClient, fetch_mock: Mock
+):
+    url = f"https://feeds.com/stored?path={path}"
+    feed_id = client.post("/feeds/", json={"url": url}).json()["id"]
+    connections, held = [0], []
+
+    def checkout(*args):
+        connections[0] += 1
+
+    def checkin(*args):
+        connections[0] -= 1
+
+    def fetch(*args, **kwargs):
+        held.append(connections[0])
+        return fetch_mock.return_value
+
+    sqlalchemy.event.listen(async_engine.sync_engine, "checkout", checkout)
+    sqlalchemy.event.listen(async_engine.sync_engine, "checkin", checkin)
+    fetch_mock.side_effect = fetch
+    response = client.post(path.format(feed_id=feed_id), json=body)
+    assert response.status_code < 300
+    assert held == [0]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+from datetime import datetime, timezone
+from unittest import mock
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+from rss_reader import bench, db
+
+
+@pytest.mark.parametrize(
+    "fraction, expected",
+    [(0.0, 1), (0.5, 6), (0.95, 10), (0.99, 10), (1.0, 10)],
+)
+def test_percentile(fraction: float, expected: float):
+    assert bench.percentile([10, 9, 8, 7, 6, 5, 4, 3, 2, 1], fraction) == expected
+
+
+def test_summarize():
+    summary = bench.summarize([0.001, 0.003], statements=4)
+    assert summary["count"] == 2
+    assert summary["mean_ms"] == pytest.approx(2)
+    assert summary["p50_ms"] == pytest.approx(3)
+    assert summary["statements_per_op"] == 2
+
+
+def assert_cleaned_up(session: Session):
+    assert not session.exec(select(db.User)).all()
+    assert not session.exec(select(db.Feed)).all()
+
+
+def test_bench_mutations(reset_db: db.Engine, async_engine: db.AsyncEngine, session: Session):
+    results = asyncio.run(bench.bench_mutations(async_engine, iterations=5))
+    assert set(results) == {"update_user", "delete_user", "delete_feed"}
+    for summary in results.values():
+        assert summary["count"] == 5
+        assert summary["statements_per_op"] == 1
+    assert_cleaned_up(session)
+
+
+def test_serve_fixtures():
+    with bench.serve_fixtures("tests/fixtures") as base_url:
+        response = httpx.get(f"{base_url}/programming.rss?bench=1")
+    assert response.status_code == 200
+    assert response.content.startswith(b"<?xml")
+
+
+def test_run(reset_db: db.Engine, async_engine: db.AsyncEngine, session: Session):
+    options = bench.BenchOptions(iterations=3, concurrency=2, users=3, feeds=2, subscriptions=2)
+    results = asyncio.run(bench.run(async_engine, options))
+    assert results["meta"]["iterations"] == 3
+    assert results["meta"]["database"] == async_engine.dialect.name
+    assert set(results["endpoints"]) == {*bench.scenarios(mock.Mock()), "delete_feed"}
+    for name, summary in results["endpoints"].items():
+        assert summary["count"] == 3, name
+        assert summary["errors"] == 0, name
+        assert summary["throughput_rps"] > 0, name
+    assert set(results["mutations"]) == {"update_user", "delete_user", "delete_feed"}
+    assert_cleaned_up(session)
+
+
+def test_run_started_at(mocker):
+    endpoints_started_at = []
+
+    async def bench_endpoints(*args):
+        endpoints_started_at.append(datetime.now(timezone.utc))
+        return {}
+
+    mocker.patch("rss_reader.bench.bench_endpoints", side_effect=bench_endpoints)
+    mocker.patch("rss_reader.bench.bench_mutations", return_value={})
+    results = asyncio.run(bench.run(mock.Mock(), bench.BenchOptions()))
+    assert datetime.fromisoformat(results["meta"]["started_at"]) <= endpoints_started_at[0]
+
+
+def test_run_cleans_up_on_failure(
+    reset_db: db.Engine, async_engine: db.AsyncEngine, session: Session, mocker
+):
+    mocker.patch("rss_reader.bench.drive", side_effect=RuntimeError)
+    options = bench.BenchOptions(iterations=2, concurrency=1, users=2, feeds=1, subscriptions=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(bench.run(async_engine, options))
+    assert_cleaned_up(session)
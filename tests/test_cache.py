@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from rss_reader import aiodb, api, cache, db
+
+
+def test_cache_backend_must_implement_interface():
+    class GetOnlyCache(cache.Cache):  # pylint: disable=abstract-method
+        """GetOnlyCache misses all but one method of the interface"""
+
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyCache()  # type: ignore[abstract]  # pylint: disable=abstract-class-instantiated
+
+
+def test_lru_cache_get_set_delete():
+    async def get_set_delete(lru: cache.LRUCache):
+        assert await lru.get("key") is None
+        await lru.set("key", "value")
+        assert await lru.get("key") == "value"
+        await lru.delete("key", "other")
+        assert await lru.get("key") is None
+
+    asyncio.run(get_set_delete(cache.LRUCache()))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    async def evict(lru: cache.LRUCache):
+        await lru.set("a", "1")
+        await lru.set("b", "2")
+        await lru.get("a")
+        await lru.set("c", "3")
+        assert await lru.get("a") == "1"
+        assert await lru.get("b") is None
+        assert await lru.get("c") == "3"
+
+    asyncio.run(evict(cache.LRUCache(size=2)))
+
+
+def test_lru_cache_expires(mocker):
+    async def expire(lru: cache.LRUCache):
+        await lru.set("key", "value", ttl=10)
+        monotonic.return_value = 109.0
+        assert await lru.get("key") == "value"
+        monotonic.return_value = 110.0
+        assert await lru.get("key") is None
+
+    monotonic = mocker.patch("rss_reader.cache.time.monotonic", return_value=100.0)
+    asyncio.run(expire(cache.LRUCache()))
+
+
+def test_redis_cache_errors_are_misses():
+    async def get_set_delete(redis_cache: cache.RedisCache):
+        await redis_cache.set("key", "value")
+        assert await redis_cache.get("key") is None
+        await redis_cache.delete("key")
+
+    asyncio.run(get_set_delete(cache.RedisCache("redis://localhost:1")))
+
+
+def test_read_through():
+    lru = cache.LRUCache()
+    load = AsyncMock(return_value=db.User(id=1, username="joe"))
+    for _ in range(2):
+        user = asyncio.run(cache.read_through(lru, "user:joe", db.User, load))
+        assert user == load.return_value
+    load.assert_awaited_once_with()
+    assert lru.stats == cache.CacheStats(hits=1, misses=1)
+
+
+def test_read_through_not_found():
+    lru = cache.LRUCache()
+    load = AsyncMock(return_value=None)
+    for _ in range(2):
+        assert asyncio.run(cache.read_through(lru, "user:joe", db.User, load)) is None
+    assert load.await_count == 2
+    assert lru.stats == cache.CacheStats(hits=0, misses=2)
+
+
+def test_read_user_cached(client: TestClient, mocker):
+    client.post("/users/", json={"username": "cached_joe"})
+    stats = client.get("/admin/stats").json()["cache"]
+    get_user = mocker.spy(aiodb, "get_user")
+    assert client.get("/users/cached_joe").json()["username"] == "cached_joe"
+    assert client.get("/users/cached_joe").json()["username"] == "cached_joe"
+    get_user.assert_called_once()
+    new_stats = client.get("/admin/stats").json()["cache"]
+    assert new_stats == {"hits": stats["hits"] + 1, "misses": stats["misses"] + 1}
+
+
+def test_update_user_invalidates(client: TestClient):
+    client.post("/users/", json={"username": "stale_joe"})
+    client.get("/users/stale_joe")
+    client.patch("/users/stale_joe", json={"username": "fresh_joe"})
+    assert client.get("/users/stale_joe").status_code == 404
+    assert client.get("/users/fresh_joe").status_code == 200
+
+
+def test_delete_user_invalidates(client: TestClient):
+    client.post("/users/", json={"username": "gone_joe"})
+    client.get("/users/gone_joe")
+    client.delete("/users/gone_joe")
+    assert client.get("/users/gone_joe").status_code == 404
+
+
+def test_read_feed_cached(client: TestClient, mocker):
+    feed_id = client.post("/feeds/", json={"url": "http://cached.com"}).json()["id"]
+    get_feed = mocker.spy(aiodb, "get_feed")
+    assert client.get(f"/feeds/{feed_id}").json()["url"] == "http://cached.com"
+    assert client.get(f"/feeds/{feed_id}").json()["url"] == "http://cached.com"
+    get_feed.assert_called_once()
+    client.delete(f"/feeds/{feed_id}")
+    assert client.get(f"/feeds/{feed_id}").status_code == 404
+
+
+def test_create_cache():
+    assert isinstance(cache.create_cache(None), cache.LRUCache)
+    assert isinstance(cache.create_cache("redis://localhost:1"), cache.RedisCache)
+    assert isinstance(api.cache_backend, cache.Cache)
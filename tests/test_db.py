@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+from sqlmodel import Session, col, select
+
+from rss_reader import aiodb, db
+from tests.conftest import DATABASE_URL
+
+
+@pytest.fixture(name="feed")
+def feed_fixture(reset_db: db.Engine, session: Session):
+    return db.add_feed(session, db.Feed(url="https://feeds.com/"))
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(engine: db.Engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def make_posts(feed: db.Feed, count: int, title: str = "title") -> list:
+    return [
+        {
+            "post_id": f"post-{i}",
+            "title": f"{title} {i}",
+            "link": f"https://feeds.com/{i}",
+            "summary": None,
+            "published": datetime(2023, 11, 16, 13, 54, i % 60),
+            "feed_id": feed.id,
+        }
+        for i in range(count)
+    ]
+
+
+def test_upsert_posts(feed: db.Feed, session: Session, statements: list):
+    assert db.upsert_posts(session, make_posts(feed, 500)) == 500
+    assert len([s for s in statements if s.startswith("INSERT INTO post")]) == 1
+    posts = session.exec(select(db.Post).order_by(col(db.Post.id))).all()
+    assert len(posts) == 500
+    assert posts[0].title == "title 0"
+    assert posts[0].feed_id == feed.id
+
+
+def test_upsert_posts_idempotent(feed: db.Feed, session: Session):
+    db.upsert_posts(session, make_posts(feed, 10))
+    assert db.upsert_posts(session, make_posts(feed, 10)) == 0
+    assert len(session.exec(select(db.Post)).all()) == 10
+
+
+def test_upsert_posts_updates_changed(feed: db.Feed, session: Session):
+    db.upsert_posts(session, make_posts(feed, 10))
+    posts = make_posts(feed, 12)
+    posts[3]["title"] = "new title"
+    assert db.upsert_posts(session, posts) == 3
+    session.expire_all()
+    post = session.exec(select(db.Post).where(db.Post.post_id == "post-3")).one()
+    assert post.title == "new title"
+
+
+def test_upsert_posts_dupes_in_batch(feed: db.Feed, session: Session):
+    posts = make_posts(feed, 3) + make_posts(feed, 3, title="last")
+    assert db.upsert_posts(session, posts) == 3
+    titles = session.exec(select(db.Post.title).order_by(col(db.Post.id))).all()
+    assert titles == ["last 0", "last 1", "last 2"]
+
+
+def test_upsert_posts_empty(session: Session, statements: list):
+    assert db.upsert_posts(session, []) == 0
+    assert not [s for s in statements if s.startswith("INSERT")]
+
+
+def test_delete_feed_cascades_to_posts(feed: db.Feed, session: Session):
+    db.upsert_posts(session, make_posts(feed, 3))
+    db.delete_feed(session, db.stored_id(feed))
+    assert not session.exec(select(db.Post)).all()
+
+
+def test_delete_feed_single_statement(feed: db.Feed, session: Session, statements: list):
+    deleted = db.delete_feed(session, db.stored_id(feed))
+    assert deleted is not None and deleted.url == "https://feeds.com/"
+    assert [s.split()[0] for s in statements] == ["DELETE"]
+    assert db.delete_feed(session, db.stored_id(feed)) is None
+
+
+def test_update_user_single_statement(reset_db: db.Engine, session: Session, statements: list):
+    user = db.add_user(session, db.User(username="river"))
+    statements.clear()
+    updated = db.update_user(session, "river", db.UserBase(username="melody"))
+    assert updated is not None
+    assert (updated.id, updated.username) == (user.id, "melody")
+    assert [s.split()[0] for s in statements] == ["UPDATE"]
+    assert db.update_user(session, "river", db.UserBase(username="song")) is None
+
+
+def test_update_user_existing(reset_db: db.Engine, session: Session):
+    db.add_user(session, db.User(username="river"))
+    db.add_user(session, db.User(username="melody"))
+    with pytest.raises(ValueError, match="User already exists"):
+        db.update_user(session, "river", db.UserBase(username="melody"))
+
+
+def test_delete_user_single_statement(reset_db: db.Engine, session: Session, statements: list):
+    db.add_user(session, db.User(username="river"))
+    statements.clear()
+    deleted = db.delete_user(session, "river")
+    assert deleted is not None and deleted.username == "river"
+    assert [s.split()[0] for s in statements] == ["DELETE"]
+    assert db.delete_user(session, "river") is None
+
+
+@pytest.mark.parametrize(
+    "database_url, expected",
+    [
+        ("postgresql://u:p@localhost:5432/db", "postgresql+asyncpg://u:p@localhost:5432/db"),
+        ("postgresql+psycopg2://u:p@host/db", "postgresql+asyncpg://u:p@host/db"),
+        ("sqlite:////var/lib/rss-reader.db", "sqlite+aiosqlite:////var/lib/rss-reader.db"),
+    ],
+)
+def test_async_database_url(database_url: str, expected: str):
+    assert db.async_database_url(database_url) == expected
+
+
+def test_pool_options():
+    options = db.PoolOptions(size=2, max_overflow=1, recycle=60, pre_ping=True, timeout=0.5)
+    test_engine = db.create_engine(DATABASE_URL, options)
+    assert test_engine.pool.size() == 2
+    assert test_engine.pool._max_overflow == 1  # pylint: disable=protected-access
+    assert test_engine.pool._recycle == 60  # pylint: disable=protected-access
+    assert test_engine.pool._pre_ping  # pylint: disable=protected-access
+    assert test_engine.pool.timeout() == 0.5
+    assert db.create_engine(DATABASE_URL, options) is test_engine
+
+
+def test_pool_stats():
+    options = db.PoolOptions(size=1, max_overflow=0, timeout=0.1)
+    test_engine = db.create_engine(DATABASE_URL, options)
+    with test_engine.connect():
+        stats = db.pool_stats(test_engine)
+        assert stats["size"] == 1
+        assert stats["checked_out"] == 1
+        assert stats["checked_in"] == 0
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            test_engine.connect()
+    stats = db.pool_stats(test_engine)
+    assert stats["checked_out"] == 0
+    assert stats["checked_in"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["wait_time_max"] >= 0.1
+    assert stats["wait_time_total"] >= stats["wait_time_max"]
+    test_engine.dispose()
+
+
+def test_sqlite_pragmas(tmp_path):
+    test_engine = db.create_engine(f"sqlite:///{tmp_path}/rss-reader.db")
+    with test_engine.connect() as connection:
+        pragmas = {
+            name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in [
+                "journal_mode",
+                "synchronous",
+                "mmap_size",
+                "busy_timeout",
+                "foreign_keys",
+            ]
+        }
+    assert pragmas == {
+        "journal_mode": "wal",
+        "synchronous": 1,  # NORMAL
+        "mmap_size": db.SQLITE_MMAP_SIZE,
+        "busy_timeout": db.SQLITE_BUSY_TIMEOUT,
+        "foreign_keys": 1,
+    }
+    assert db.pool_stats(test_engine)["size"] == db.POOL_SIZE
+
+
+def test_sqlite_in_memory_keeps_default_pool():
+    test_engine = db.create_engine("sqlite://")
+    db.create_tables(test_engine)
+    with Session(test_engine) as session:
+        assert db.add_user(session, db.User(username="amy")).id == 1
+    assert not db.pool_stats(test_engine)
+
+
+def test_sqlite_crud(tmp_path):
+    database_url = f"sqlite:///{tmp_path}/rss-reader.db"
+    db.create_tables(db.create_engine(database_url))
+
+    async def crud():
+        async with db.create_async_session(db.create_async_engine(database_url)) as session:
+            user = await aiodb.add_user(session, db.User(username="amy"))
+            assert (await aiodb.add_users(session, [db.User(username="amy")])) == {}
+            user = await aiodb.update_user(session, "amy", db.UserBase(username="pond"))
+            feed = await aiodb.add_feed(session, db.Feed(url="https://feeds.com/"))
+            await aiodb.subscribe(session, user.id, feed.id)
+            posts = make_posts(feed, 3)
+            assert await aiodb.upsert_posts(session, posts) == 3
+            assert await aiodb.upsert_posts(session, posts) == 0
+            [unread] = await aiodb.get_unread_counts(session, user.id)
+            assert unread.unread_count == 3
+            timeline = await aiodb.get_timeline(session, user.id, limit=2)
+            assert [post.post_id for post in timeline] == ["post-2", "post-1"]
+            assert await aiodb.mark_read(session, user.id, [timeline[0].id]) == 1
+            [unread] = await aiodb.get_unread_counts(session, user.id)
+            assert unread.unread_count == 2
+            assert (
+                await aiodb.delete_feed(session, db.stored_id(feed))
+            ).url == "https://feeds.com/"
+            assert not await aiodb.get_timeline(session, user.id)
+            assert (await aiodb.delete_user(session, "pond")).id == user.id
+        await db.create_async_engine(database_url).dispose()
+
+    asyncio.run(crud())
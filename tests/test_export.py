@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from rss_reader import db, export
+
+
+@pytest.fixture(name="feeds")
+def feeds_fixture(reset_db: db.Engine, session: Session):
+    feeds = [db.Feed(url=f"https://{n}.example.com/rss", title=f"Feed {n}") for n in range(5)]
+    db.add_feeds(session, feeds)
+    posts = [
+        {
+            "post_id": "post-1",
+            "title": "Post 1",
+            "link": None,
+            "summary": None,
+            "published": datetime(2023, 11, 16, 13, 54, 19),
+            "feed_id": db.get_feed_ids(session, [feeds[0].url])[feeds[0].url],
+        }
+    ]
+    db.upsert_posts(session, posts)
+
+
+def test_export(async_engine: db.AsyncEngine, feeds):
+    async def collect():
+        return [chunk async for chunk in export.export(async_engine, "feeds", batch_size=2)]
+
+    chunks = asyncio.run(collect())
+    assert [chunk.count("\n") for chunk in chunks] == [2, 2, 1]
+    rows = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert [row["title"] for row in rows] == [f"Feed {n}" for n in range(5)]
+    assert rows == sorted(rows, key=lambda row: row["id"])
+
+
+def test_export_endpoint(client: TestClient, feeds):
+    response = client.get("/export/posts")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    [row] = [json.loads(line) for line in response.text.splitlines()]
+    assert row["post_id"] == "post-1"
+    assert row["published"] == "2023-11-16T13:54:19"
+
+
+def test_export_endpoint_unknown_table(client: TestClient):
+    assert client.get("/export/passwords").status_code == 422
+
+
+def test_to_json_unserializable():
+    with pytest.raises(TypeError):
+        json.dumps({"value": object()}, default=export.to_json)
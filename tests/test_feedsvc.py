@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+import functools
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+import pytest
+
+from rss_reader import feedsvc
+
+
+def fixture_handler(request: httpx.Request) -> httpx.Response:
+    if request.headers.get("If-None-Match") == '"v1"':
+        return httpx.Response(304)
+    with open(f"tests/fixtures{request.url.path}", "rb") as file:
+        headers = {"ETag": '"v1"', "Last-Modified": "Thu, 16 Nov 2023 13:54:19 GMT"}
+        return httpx.Response(200, headers=headers, content=file.read())
+
+
+def timeout_handler(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectTimeout("timed out", request=request)
+
+
+def test_fetcher_fetch():
+    async def fetch():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(fixture_handler))
+        document = await fetcher.fetch("https://feeds.com/programming.rss")
+        await fetcher.close()
+        return document
+
+    document = asyncio.run(fetch())
+    assert document.content.startswith(b'<?xml version="1.0" encoding="UTF-8"?>')
+    assert document.etag == '"v1"'
+    assert document.modified == "Thu, 16 Nov 2023 13:54:19 GMT"
+    assert document.status is feedsvc.FetchStatus.FETCHED
+    assert not document.truncated
+    assert document.channel["title"] == "programming"
+
+
+def test_fetcher_fetch_conditional():
+    async def fetch():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(fixture_handler))
+        hit = await fetcher.fetch("https://feeds.com/programming.rss", etag='"v1"')
+        miss = await fetcher.fetch("https://feeds.com/programming.rss", etag='"v0"')
+        await fetcher.close()
+        return fetcher, hit, miss
+
+    fetcher, hit, miss = asyncio.run(fetch())
+    assert hit == feedsvc.Document(etag='"v1"', status=feedsvc.FetchStatus.NOT_MODIFIED)
+    assert miss.status is feedsvc.FetchStatus.FETCHED
+    assert miss.etag == '"v1"'
+    assert fetcher.stats == feedsvc.FetchStats(hits=1, misses=1)
+
+
+def test_fetcher_fetch_error():
+    async def fetch():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(timeout_handler))
+        document = await fetcher.fetch("https://feeds.com/programming.rss")
+        await fetcher.close()
+        return document
+
+    assert asyncio.run(fetch()) == feedsvc.Document(status=feedsvc.FetchStatus.FAILED)
+
+
+def test_fetcher_concurrency_cap():
+    in_flight, peak = 0, 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, content=b"")
+
+    async def fetch_all():
+        fetcher = feedsvc.Fetcher(concurrency=3, transport=httpx.MockTransport(handler))
+        await asyncio.gather(*(fetcher.fetch(f"https://feeds{i}.com/") for i in range(10)))
+        await fetcher.close()
+
+    asyncio.run(fetch_all())
+    assert peak == 3
+
+
+class EndlessFeed(httpx.AsyncByteStream):
+    """A feed that never ends, counting the entries read from it"""
+
+    def __init__(self):
+        self.chunks = 0
+
+    async def __aiter__(self):
+        yield b'<?xml version="1.0"?><rss><channel><title>Endless</title>'
+        while True:
+            self.chunks += 1
+            yield b"<item><guid>%d</guid><description>%s</description></item>" % (
+                self.chunks,
+                b"x" * 1000,
+            )
+
+
+@pytest.mark.parametrize(
+    "max_bytes, max_entries, entries",
+    [(10_000_000, 50, 50), (20_000, 1000, 18)],
+)
+def test_fetcher_fetch_limits(max_bytes: int, max_entries: int, entries: int):
+    stream = EndlessFeed()
+
+    async def fetch():
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=stream))
+        fetcher = feedsvc.Fetcher(
+            transport=transport, max_bytes=max_bytes, max_entries=max_entries
+        )
+        document = await fetcher.fetch("https://feeds.com/endless.rss")
+        await fetcher.close()
+        return document
+
+    document = asyncio.run(fetch())
+    assert document.truncated
+    assert len(document.content) <= max_bytes
+    assert stream.chunks <= entries + 1
+    assert document.channel == {"title": "Endless"}
+    assert document.content.endswith(b"</item></channel></rss>")
+    posts = feedsvc.parser.parse(document.content)["posts"]
+    assert [post["post_id"] for post in posts] == [str(i) for i in range(1, entries + 1)]
+
+
+@pytest.mark.parametrize(
+    "fixture, title, posts",
+    [
+        ("programming.rss", "programming", 26),
+        ("not_a_feed.rss", "No title (or not a RSS feed)", 0),
+        ("404_error.rss", "No title (or not a RSS feed)", 0),
+    ],
+)
+def test_replenish(fixture: str, title: str, posts: int, mocker):
+    with open(f"tests/fixtures/{fixture}", "rb") as file:
+        document = feedsvc.Document(content=file.read(), etag='"v1"')
+    mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+    feed = feedsvc.Feed(url="https://feeds.com/")
+    assert len(asyncio.run(feedsvc.replenish(feed)) or []) == posts
+    assert feed.title == title
+    assert feed.etag == '"v1"'
+
+
+def test_replenish_not_modified(mocker):
+    fetch = mocker.patch(
+        "rss_reader.feedsvc.fetch",
+        return_value=feedsvc.Document(status=feedsvc.FetchStatus.NOT_MODIFIED),
+    )
+    feed = feedsvc.Feed(url="https://feeds.com/", title="title", etag='"v1"', modified="today")
+    assert asyncio.run(feedsvc.replenish(feed)) is None
+    assert feed.title == "title"
+    fetch.assert_awaited_once_with("https://feeds.com/", etag='"v1"', modified="today")
+
+
+def test_replenish_failed(mocker):
+    mocker.patch(
+        "rss_reader.feedsvc.fetch",
+        return_value=feedsvc.Document(status=feedsvc.FetchStatus.FAILED),
+    )
+    feed = feedsvc.Feed(url="https://feeds.com/", title="title", etag='"v1"', modified="today")
+    with pytest.raises(feedsvc.FetchError):
+        asyncio.run(feedsvc.replenish(feed))
+    assert (feed.title, feed.etag, feed.modified) == ("title", '"v1"', "today")
+
+
+def test_replenish_posts(mocker):
+    with open("tests/fixtures/programming.rss", "rb") as file:
+        document = feedsvc.Document(content=file.read())
+    mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+    posts = asyncio.run(feedsvc.replenish(feedsvc.Feed(url="https://feeds.com/")))
+    assert posts[0]["post_id"] == "t3_173viwj"
+    assert posts[0]["title"] == "[META] The future of r/programming"
+    assert posts[0]["link"].endswith("/173viwj/meta_the_future_of_rprogramming/")
+    assert posts[0]["summary"].startswith("<!-- SC_OFF -->")
+    assert posts[0]["published"] == datetime(2023, 10, 9, 16, 3, 36)
+
+
+def test_replenish_channel_fields(mocker):
+    document = feedsvc.Document(
+        content=b"<rss><channel><title>Parsed</title></channel></rss>",
+        channel={"title": "Scanned", "updated": datetime(2023, 11, 16)},
+    )
+    mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+    feed = feedsvc.Feed(url="https://feeds.com/")
+    asyncio.run(feedsvc.replenish(feed))
+    assert feed.title == "Parsed"
+    assert feed.updated == datetime(2023, 11, 16)
+
+
+def test_replenish_channel_markup(mocker):
+    content = (
+        b'<rss version="2.0"><channel><title>Markup</title><description>'
+        b"&lt;script&gt;alert(1)&lt;/script&gt;Hi &lt;b&gt;there&lt;/b&gt;"
+        b"</description></channel></rss>"
+    )
+    scanner = feedsvc.parser.FeedScanner()
+    scanner.feed(content)
+    document = feedsvc.Document(content=content, channel=scanner.channel_fields())
+    mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+    feed = feedsvc.Feed(url="https://feeds.com/")
+    asyncio.run(feedsvc.replenish(feed))
+    assert feed.subtitle == "Hi <b>there</b>"
+
+
+@pytest.mark.parametrize(
+    "url, normalized",
+    [
+        ("HTTPS://Feeds.COM:443/rss#top", "https://feeds.com/rss"),
+        ("http://feeds.com", "http://feeds.com/"),
+        ("http://feeds.com:8080/rss?a=1", "http://feeds.com:8080/rss?a=1"),
+        ("https://user:pw@Feeds.com/rss", "https://user:pw@feeds.com/rss"),
+    ],
+)
+def test_normalize_url(url: str, normalized: str):
+    assert feedsvc.normalize_url(url) == normalized
+
+
+def test_flight_key():
+    key = feedsvc.flight_key("https://feeds.com/rss", None, None)
+    assert key == feedsvc.flight_key("HTTPS://FEEDS.COM/rss#entries", None, None)
+    assert key != feedsvc.flight_key("https://feeds.com/rss", '"v1"', None)
+
+
+@pytest.fixture(name="slow_fetch_mock")
+def slow_fetch_mock_fixture(mocker):
+    with open("tests/fixtures/programming.rss", "rb") as file:
+        document = feedsvc.Document(content=file.read(), etag='"v1"')
+
+    async def fetch(url: str, etag: Optional[str] = None, modified: Optional[str] = None):
+        await asyncio.sleep(0.05)
+        return document
+
+    return mocker.patch("rss_reader.feedsvc.fetch", side_effect=fetch)
+
+
+def test_replenish_coalesced(slow_fetch_mock, mocker):
+    mocker.patch.object(feedsvc, "get_single_flight", return_value=feedsvc.SingleFlight())
+    urls = ["https://feeds.com/rss", "https://FEEDS.com/rss", "https://feeds.com/rss#x"]
+    feeds = [feedsvc.Feed(url=url) for url in urls]
+
+    async def replenish_all():
+        return await asyncio.gather(*(feedsvc.replenish(feed) for feed in feeds))
+
+    posts = asyncio.run(replenish_all())
+    slow_fetch_mock.assert_awaited_once()
+    assert [len(feed_posts) for feed_posts in posts] == [26, 26, 26]
+    assert posts[0][0] is not posts[1][0]
+    assert {feed.title for feed in feeds} == {"programming"}
+    assert feedsvc.get_single_flight().coalesced == 2
+    assert not feedsvc.get_single_flight().calls
+    asyncio.run(feedsvc.replenish(feedsvc.Feed(url=urls[0])))
+    assert slow_fetch_mock.await_count == 2
+
+
+def test_replenish_coalesced_error(mocker):
+    mocker.patch.object(feedsvc, "get_single_flight", return_value=feedsvc.SingleFlight())
+
+    async def fetch(url: str, etag: Optional[str] = None, modified: Optional[str] = None):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    fetch_mock = mocker.patch("rss_reader.feedsvc.fetch", side_effect=fetch)
+
+    async def replenish_all():
+        feeds = [feedsvc.Feed(url="https://feeds.com/rss") for _ in range(2)]
+        return await asyncio.gather(*map(feedsvc.replenish, feeds), return_exceptions=True)
+
+    assert [str(err) for err in asyncio.run(replenish_all())] == ["boom", "boom"]
+    fetch_mock.assert_awaited_once()
+
+
+class FakeRedis:
+    """Just enough of a Redis server, shared by workers, to coalesce fetches"""
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+
+    async def set(self, key: str, value: Any, nx: bool = False, px: Optional[int] = None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    async def get(self, key: str):
+        return self.values.get(key)
+
+    async def exists(self, key: str):
+        return int(key in self.values)
+
+    async def delete(self, key: str):
+        self.values.pop(key, None)
+
+
+def test_replenish_coalesced_across_workers(slow_fetch_mock, mocker):
+    server = FakeRedis()
+    workers = [feedsvc.RedisSingleFlight("redis://localhost:1") for _ in range(3)]
+    for worker in workers:
+        worker.redis = server
+    feed = feedsvc.Feed(url="https://feeds.com/rss")
+    key = feedsvc.flight_key(feed.url, None, None)
+    call = functools.partial(feedsvc.load, feed.url, None, None)
+
+    async def load_all():
+        return await asyncio.gather(*(worker.do(key, call) for worker in workers))
+
+    loaded = asyncio.run(load_all())
+    slow_fetch_mock.assert_awaited_once()
+    assert loaded[1] == loaded[2] == loaded[0]
+    assert loaded[1]["updated"] == datetime(2023, 11, 16, 13, 54, 19)
+    assert loaded[1]["posts"][0]["published"] == datetime(2023, 10, 9, 16, 3, 36)
+    assert sum(worker.coalesced for worker in workers) == 2
+    assert f"{feedsvc.RedisSingleFlight.prefix}lock:{key}" not in server.values
+
+
+def test_replenish_coalesced_redis_errors(slow_fetch_mock):
+    single_flight = feedsvc.RedisSingleFlight("redis://localhost:1")
+    call = functools.partial(feedsvc.load, "https://feeds.com/rss", None, None)
+    loaded = asyncio.run(single_flight.do("key", call))
+    assert loaded["title"] == "programming"
+    slow_fetch_mock.assert_awaited_once()
+
+
+def test_create_single_flight():
+    assert isinstance(feedsvc.get_single_flight.__wrapped__(None), feedsvc.SingleFlight)
+    redis_single_flight = feedsvc.get_single_flight.__wrapped__("redis://localhost:1")
+    assert isinstance(redis_single_flight, feedsvc.RedisSingleFlight)
+
+
+def test_failure_tracker_backoff():
+    tracker = feedsvc.FailureTracker(threshold=2, backoff=10, max_backoff=25)
+    tracker.failure("key", 0)
+    assert not tracker.blocked("key", 0)
+    tracker.failure("key", 0)
+    assert tracker.blocked("key", 9.9)
+    assert not tracker.blocked("key", 10)
+    tracker.failure("key", 10)
+    assert tracker.blocked("key", 29.9)
+    assert not tracker.blocked("key", 30)
+    tracker.failure("key", 30)
+    assert tracker.entries["key"].retry_at == 55
+    tracker.success("key")
+    assert not tracker.blocked("key", 30)
+    assert not tracker.entries
+
+
+def test_failure_tracker_size():
+    tracker = feedsvc.FailureTracker(size=2)
+    for key in ["a", "b", "a", "c"]:
+        tracker.failure(key, 0)
+    assert list(tracker.entries) == ["a", "c"]
+
+
+def test_host_limiter():
+    in_flight: Dict[str, int] = {}
+    peak: Dict[str, int] = {}
+    starts: List[float] = []
+
+    async def request(limiter: feedsvc.HostLimiter, host: str):
+        async with limiter.limit(host):
+            if host == "paced.com":
+                starts.append(time.monotonic())
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+
+    async def request_all():
+        limiter = feedsvc.HostLimiter(concurrency=2, rate=0)
+        await asyncio.gather(*(request(limiter, f"host{i % 2}.com") for i in range(10)))
+        paced = feedsvc.HostLimiter(concurrency=5, rate=50)
+        await asyncio.gather(*(request(paced, "paced.com") for _ in range(3)))
+        return limiter
+
+    limiter = asyncio.run(request_all())
+    assert peak == {"host0.com": 2, "host1.com": 2, "paced.com": 1}
+    assert starts[2] - starts[0] >= 0.035
+    limiter.prune(time.monotonic())
+    assert not limiter.hosts
+
+
+def status_handler(request: httpx.Request) -> httpx.Response:
+    if request.url.host == "down.com":
+        raise httpx.ConnectError("connection refused", request=request)
+    return httpx.Response(int(request.url.path.strip("/")), content=b"<html></html>")
+
+
+def test_fetcher_backs_off_failing_urls():
+    async def fetch_all():
+        transport = httpx.MockTransport(status_handler)
+        fetcher = feedsvc.Fetcher(transport=transport)
+        calls: List[httpx.Request] = []
+
+        async def record(request: httpx.Request):
+            calls.append(request)
+
+        fetcher.client.event_hooks["request"].append(record)
+        documents = [await fetcher.fetch("https://feeds.com/404") for _ in range(3)]
+        documents.append(await fetcher.fetch("https://feeds.com/200"))
+        await fetcher.close()
+        return fetcher, documents, calls
+
+    fetcher, documents, calls = asyncio.run(fetch_all())
+    assert [str(request.url) for request in calls] == [
+        "https://feeds.com/404",
+        "https://feeds.com/200",
+    ]
+    assert documents[0] == feedsvc.Document(status=feedsvc.FetchStatus.FAILED)
+    for document in documents[1:3]:
+        assert document.status is feedsvc.FetchStatus.SKIPPED
+        assert 0 < document.retry_after <= feedsvc.FAILURE_BACKOFF
+    assert documents[3].content == b"<html></html>"
+    assert fetcher.stats.skipped == 2
+    assert "feeds.com" not in fetcher.hosts.entries
+
+
+@pytest.mark.parametrize("url", ["https://down.com/rss", "https://feeds.com/503"])
+def test_fetcher_opens_circuit_of_failing_hosts(url: str, mocker):
+    mocker.patch.object(feedsvc, "HOST_FAILURE_THRESHOLD", 2)
+    host = httpx.URL(url).host
+
+    async def fetch_all():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(status_handler))
+        for i in range(2):
+            await fetcher.fetch(f"{url}?{i}")
+        assert fetcher.hosts.blocked(host, time.monotonic())
+        await fetcher.fetch(f"https://{host}/200")
+        await fetcher.close()
+        return fetcher
+
+    fetcher = asyncio.run(fetch_all())
+    assert fetcher.stats.skipped == 1
+
+
+def test_fetcher_trial_after_backoff():
+    async def fetch_all():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(status_handler))
+        await fetcher.fetch("https://feeds.com/500")
+        fetcher.urls.entries["https://feeds.com/500"].retry_at = 0
+        await fetcher.fetch("https://feeds.com/500")
+        await fetcher.close()
+        return fetcher
+
+    fetcher = asyncio.run(fetch_all())
+    assert fetcher.urls.entries["https://feeds.com/500"].failures == 2
+    assert fetcher.stats.skipped == 0
+
+
+def test_fetcher_single_trial_after_backoff(mocker):
+    mocker.patch.object(feedsvc, "HOST_FAILURE_THRESHOLD", 1)
+    calls: List[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(503)
+
+    async def fetch_all():
+        fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(handler))
+        await fetcher.fetch("https://dead.com/0")
+        fetcher.hosts.entries["dead.com"].retry_at = 0
+        documents = await asyncio.gather(
+            *(fetcher.fetch(f"https://dead.com/{i}") for i in range(1, 51))
+        )
+        await fetcher.close()
+        return fetcher, documents
+
+    fetcher, documents = asyncio.run(fetch_all())
+    assert len(calls) == 2
+    statuses = [document.status for document in documents]
+    assert statuses.count(feedsvc.FetchStatus.FAILED) == 1
+    assert statuses.count(feedsvc.FetchStatus.SKIPPED) == 49
+    assert fetcher.hosts.entries["dead.com"].failures == 2
+
+
+def test_replenish_backs_off_not_a_feed(mocker):
+    fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(fixture_handler))
+    mocker.patch.object(feedsvc, "get_fetcher", return_value=fetcher)
+    url = "https://feeds.com/not_a_feed.rss"
+    asyncio.run(feedsvc.replenish(feedsvc.Feed(url=url)))
+    assert fetcher.urls.blocked(url, time.monotonic())
+    with pytest.raises(feedsvc.FetchSkipped) as exc_info:
+        asyncio.run(feedsvc.replenish(feedsvc.Feed(url=url)))
+    assert 0 < exc_info.value.retry_after <= feedsvc.FAILURE_BACKOFF
+    assert fetcher.stats.skipped == 1
+    asyncio.run(feedsvc.replenish(feedsvc.Feed(url="https://feeds.com/programming.rss")))
+    assert not fetcher.urls.entries.keys() - {url}
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from rss_reader import db, feedsvc, importer
+
+
+OPML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<opml version="2.0">
+  <head><title>Subscriptions</title></head>
+  <body>
+    <outline text="Programming">
+      <outline text="r/programming" xmlUrl="https://www.reddit.com/r/programming/.rss"/>
+      <outline text="r/python" xmlUrl="https://www.reddit.com/r/python/.rss"/>
+    </outline>
+    <outline text="No feed here"/>
+  </body>
+</opml>
+"""
+
+
+@pytest.fixture(name="fetch_mock")
+def fetch_mock_fixture(mocker):
+    with open("tests/fixtures/programming.rss", "rb") as file:
+        document = feedsvc.Document(content=file.read())
+    return mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        OPML,
+        b'["https://www.reddit.com/r/programming/.rss", "https://www.reddit.com/r/python/.rss"]',
+        b"# feeds\nhttps://www.reddit.com/r/programming/.rss\n\n"
+        b" https://www.reddit.com/r/python/.rss \n",
+    ],
+)
+def test_parse_feed_list(content):
+    assert importer.parse_feed_list(content) == [
+        "https://www.reddit.com/r/programming/.rss",
+        "https://www.reddit.com/r/python/.rss",
+    ]
+
+
+@pytest.mark.parametrize("content", [b"<opml>", b"[1, 2]", b"[broken"])
+def test_parse_feed_list_invalid(content):
+    with pytest.raises(ValueError):
+        importer.parse_feed_list(content)
+
+
+def test_import_feeds(session: Session, client: TestClient, fetch_mock: Mock):
+    existing = client.post("/feeds/", json={"url": "https://www.reddit.com/r/python/.rss"}).json()
+    fetch_mock.reset_mock()
+    response = client.post("/feeds/import", content=OPML)
+    assert response.status_code == 200
+    data = response.json()
+    assert [(result["url"], result["status"]) for result in data] == [
+        ("https://www.reddit.com/r/programming/.rss", "created"),
+        ("https://www.reddit.com/r/python/.rss", "exists"),
+    ]
+    assert data[1]["id"] == existing["id"]
+    fetch_mock.assert_awaited_once_with(
+        "https://www.reddit.com/r/programming/.rss", etag=None, modified=None
+    )
+    feed = session.get(db.Feed, data[0]["id"])
+    assert feed is not None
+    assert feed.title == "programming"
+    assert feed.next_fetch_at > db.utcnow()
+    posts = session.exec(select(db.Post).where(db.Post.feed_id == feed.id)).all()
+    assert len(posts) == 26
+
+
+def test_import_feeds_keeps_order_and_reports_invalid(
+    client: TestClient, fetch_mock: Mock, mocker
+):
+    mocker.patch("rss_reader.importer.IMPORT_BATCH_SIZE", 1)
+    urls = ["https://a.example.com/rss", "not a url", "https://b.example.com/rss"]
+    content = "\n".join(urls + urls[:1]).encode()
+    response = client.post("/feeds/import", content=content)
+    assert response.status_code == 200
+    data = response.json()
+    assert [result["status"] for result in data] == ["created", "invalid", "created", "created"]
+    assert data[0]["id"] == data[3]["id"]
+    assert data[1]["detail"]
+    assert fetch_mock.await_count == 2
+
+
+def test_import_feeds_invalid_document(client: TestClient):
+    response = client.post("/feeds/import", content=b"<opml")
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("Invalid OPML document")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import io
+import logging
+import queue
+import threading
+from typing import List
+
+import pytest
+
+from rss_reader import db, logger
+
+
+class RecordingHandler(logging.Handler):
+    """RecordingHandler keeps the messages of the records it handles, and counts the
+    times it's flushed"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages: List[str] = []
+        self.flushes = 0
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def flush(self):
+        self.flushes += 1
+
+
+def record(level: int, msg: str, *args) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+@pytest.fixture(name="source")
+def source_fixture():
+    return logger.BoundedQueueHandler(queue.Queue(10), sample_rate=0, high_water=0.5)
+
+
+def test_queue_handler_prepares_records(source):
+    source.handle(record(logging.ERROR, "Failed to fetch %s", "url"))
+    queued = source.queue.get_nowait()
+    assert queued.msg == "Failed to fetch url"
+    assert queued.args is None
+
+
+def test_queue_handler_sheds_below_warning_past_high_water(source):
+    for i in range(8):
+        source.handle(record(logging.INFO, "info %d", i))
+    for i in range(4):
+        source.handle(record(logging.WARNING, "warning %d", i))
+    messages = [source.queue.get_nowait().msg for _ in range(source.queue.qsize())]
+    assert messages == [f"info {i}" for i in range(5)] + [f"warning {i}" for i in range(4)]
+    assert source.take_dropped() == 3
+
+
+def test_queue_handler_drops_when_full(source):
+    for i in range(12):
+        source.handle(record(logging.ERROR, "error %d", i))
+    assert source.queue.qsize() == 10
+    assert source.take_dropped() == 2
+    assert source.take_dropped() == 0
+
+
+def test_queue_handler_samples(mocker):
+    source = logger.BoundedQueueHandler(queue.Queue(10), sample_rate=0.5, high_water=0)
+    mocker.patch.object(logger.random, "random", side_effect=[0.9, 0.1])
+    source.handle(record(logging.DEBUG, "dropped"))
+    source.handle(record(logging.DEBUG, "sampled"))
+    assert source.queue.get_nowait().msg == "sampled"
+    assert source.take_dropped() == 1
+
+
+def test_shipper_ships_in_batches(source):
+    handler = RecordingHandler()
+    for i in range(7):
+        source.handle(record(logging.ERROR, "error %d", i))
+    source.queue.put(None)
+    logger.LogShipper(source, [handler], batch_size=3).run(source.queue)
+    assert handler.messages == [f"error {i}" for i in range(7)]
+    assert handler.flushes == 3
+
+
+def test_shipper_reports_dropped(source):
+    handler = RecordingHandler()
+    for i in range(11):
+        source.handle(record(logging.ERROR, "error %d", i))
+    shipper = logger.LogShipper(source, [handler])
+    shipper.start()
+    shipper.stop()
+    assert handler.messages[-1] == "Dropped 1 log records"
+
+
+def test_shipper_respects_handler_level(source):
+    handler = RecordingHandler()
+    handler.setLevel(logging.ERROR)
+    source.handle(record(logging.WARNING, "warning"))
+    source.handle(record(logging.ERROR, "error"))
+    shipper = logger.LogShipper(source, [handler])
+    shipper.start()
+    shipper.stop()
+    assert handler.messages == ["error"]
+
+
+def test_log_calls_do_not_wait_for_handlers(source):
+    release = threading.Event()
+
+    class SlowHandler(RecordingHandler):
+        """SlowHandler blocks until released"""
+
+        def emit(self, record):
+            release.wait()
+            super().emit(record)
+
+    handler = SlowHandler()
+    shipper = logger.LogShipper(source, [handler])
+    shipper.start()
+    try:
+        for i in range(20):
+            source.handle(record(logging.ERROR, "error %d", i))
+    finally:
+        release.set()
+        shipper.stop()
+    assert handler.messages[:10] == [f"error {i}" for i in range(10)]
+
+
+def test_batch_stream_handler_leaves_flushing(mocker):
+    stream = io.StringIO()
+    handler = logger.BatchStreamHandler(stream)
+    flush = mocker.patch.object(handler, "flush")
+    handler.handle(record(logging.ERROR, "error"))
+    assert stream.getvalue() == "error\n"
+    flush.assert_not_called()
+
+
+def test_engine_does_not_echo():
+    assert "echo" not in db.engine_kwargs("sqlite://", None, db.TimedQueuePool)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+
+import httpx
+import pytest
+import sqlalchemy
+from prometheus_client import REGISTRY
+
+from rss_reader import db, feedsvc, metrics
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.parametrize(
+    "statement, kind",
+    [
+        ("SELECT 1", "SELECT"),
+        ("\n  insert into post (id) VALUES (1)", "INSERT"),
+        ("", "UNKNOWN"),
+    ],
+)
+def test_statement_kind(statement: str, kind: str):
+    assert metrics.statement_kind(statement) == kind
+
+
+def test_request_latency_by_route(client, reset_db):
+    name = "rss_reader_request_duration_seconds_count"
+    labels = {"method": "GET", "route": "/users/{username}", "status": "404"}
+    before = sample(name, **labels)
+    client.get("/users/nobody")
+    client.get("/users/somebody")
+    assert sample(name, **labels) == before + 2
+    assert sample("rss_reader_requests_in_flight") == 0
+
+
+def test_request_latency_unmatched(client):
+    name = "rss_reader_request_duration_seconds_count"
+    labels = {"method": "GET", "route": metrics.UNMATCHED, "status": "404"}
+    before = sample(name, **labels)
+    client.get("/no/such/route")
+    assert sample(name, **labels) == before + 1
+
+
+def test_metrics_endpoint(client):
+    client.get("/admin/stats")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'rss_reader_request_duration_seconds_count{method="GET",route="/admin/stats"' in (
+        response.text
+    )
+
+
+def test_db_statement_latency(engine):
+    name = "rss_reader_db_statement_duration_seconds_count"
+    before = sample(name, statement="SELECT")
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1"))
+        with pytest.raises(sqlalchemy.exc.DBAPIError):
+            conn.execute(sqlalchemy.text("SELECT * FROM no_such_table"))
+    assert sample(name, statement="SELECT") == before + 1
+    with engine.connect() as conn:
+        assert not conn.info.get("statement_started_at")
+
+
+def test_db_statement_latency_async_engine():
+    name = "rss_reader_db_statement_duration_seconds_count"
+    before = sample(name, statement="SELECT")
+
+    async def execute():
+        async_engine = db.create_async_engine.__wrapped__("sqlite://")
+        async with async_engine.connect() as conn:
+            await conn.execute(sqlalchemy.text("SELECT 1"))
+        await async_engine.dispose()
+
+    asyncio.run(execute())
+    assert sample(name, statement="SELECT") == before + 1
+
+
+def test_fetch_latency_phases(mocker):
+    def handler(request: httpx.Request) -> httpx.Response:
+        with open(f"tests/fixtures{request.url.path}", "rb") as file:
+            return httpx.Response(200, content=file.read())
+
+    name = "rss_reader_fetch_duration_seconds_count"
+    network, parse = sample(name, phase="network"), sample(name, phase="parse")
+    fetcher = feedsvc.Fetcher(transport=httpx.MockTransport(handler))
+    mocker.patch("rss_reader.feedsvc.get_fetcher", return_value=fetcher)
+    asyncio.run(feedsvc.replenish(feedsvc.Feed(url="https://feeds.com/programming.rss")))
+    assert sample(name, phase="network") == network + 1
+    assert sample(name, phase="parse") == parse + 1
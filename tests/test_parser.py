@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+
+from rss_reader import parser
+
+
+@pytest.fixture(name="content")
+def content_fixture():
+    with open("tests/fixtures/programming.rss", "rb") as file:
+        return file.read()
+
+
+@pytest.fixture(name="workers")
+def workers_fixture(request, mocker):
+    parser.shutdown()
+    mocker.patch.object(parser, "PARSE_WORKERS", request.param)
+    yield request.param
+    parser.shutdown()
+
+
+def test_parse(content: bytes):
+    parsed = parser.parse(content)
+    assert parsed["title"] == "programming"
+    assert parsed["subtitle"] == "Computer Programming"
+    assert len(parsed["posts"]) == 26
+    assert parsed["posts"][0]["published"] == datetime(2023, 10, 9, 16, 3, 36)
+
+
+def test_parse_not_a_feed():
+    parsed = parser.parse(b"<html><body>Nothing to see here</body></html>")
+    assert parsed["title"] == "No title (or not a RSS feed)"
+    assert parsed["updated"] is None
+    assert not parsed["posts"]
+
+
+@pytest.mark.parametrize("workers", [0, 2], indirect=True)
+def test_parse_async(content: bytes, workers: int):
+    async def parse():
+        return await asyncio.gather(*(parser.parse_async(content) for _ in range(4)))
+
+    assert asyncio.run(parse()) == [parser.parse(content)] * 4
+    assert (parser.get_executor() is None) is (workers == 0)
+
+
+@pytest.mark.parametrize("workers", [1], indirect=True)
+def test_parse_async_broken_pool(content: bytes, workers: int):
+    async def parse():
+        await parser.parse_async(content)
+        executor = parser.get_executor()
+        # pylint: disable=protected-access
+        os.kill(next(iter(executor._processes)), 9)
+        assert await parser.parse_async(content) == parser.parse(content)
+        return executor
+
+    broken = asyncio.run(parse())
+    assert parser.get_executor() is not broken
+    assert asyncio.run(parser.parse_async(content))["title"] == "programming"
+
+
+RSS = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel>
+<title>Channel</title><description>About it</description>
+<lastBuildDate>Thu, 16 Nov 2023 13:54:19 +0100</lastBuildDate>
+<item><title>One</title><guid>1</guid></item>
+<item><title>Two</title><guid>2</guid></item>
+<item><title>Three</title><guid>3</guid></item>
+</channel></rss>"""
+
+
+def scan(content: bytes, max_entries: int = 10, chunk_size: int = 7) -> parser.FeedScanner:
+    scanner = parser.FeedScanner(max_entries)
+    for start in range(0, len(content), chunk_size):
+        end = start + chunk_size
+        scanner.feed(content[start:end])
+        if scanner.done:
+            break
+    return scanner
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2023-11-16T13:54:19+00:00", datetime(2023, 11, 16, 13, 54, 19)),
+        ("2023-11-16T13:54:19Z", datetime(2023, 11, 16, 13, 54, 19)),
+        ("Thu, 16 Nov 2023 13:54:19 +0100", datetime(2023, 11, 16, 12, 54, 19)),
+        ("yesterday", None),
+    ],
+)
+def test_parse_date(value: str, expected: datetime):
+    assert parser.parse_date(value) == expected
+
+
+def test_scanner_channel_fields():
+    scanner = scan(RSS)
+    assert scanner.entries == 3
+    assert not scanner.done
+    assert scanner.channel_fields() == {
+        "title": "Channel",
+        "subtitle": "About it",
+        "updated": datetime(2023, 11, 16, 12, 54, 19),
+    }
+    assert scanner.document(len(RSS)) == RSS
+
+
+def test_scanner_atom_channel_fields(content: bytes):
+    scanner = scan(content, max_entries=100, chunk_size=4096)
+    assert scanner.entries == 26
+    assert scanner.channel_fields() == {
+        "title": "programming",
+        "subtitle": "Computer Programming",
+        "updated": datetime(2023, 11, 16, 13, 54, 19),
+    }
+
+
+def test_scanner_stops_at_max_entries():
+    scanner = scan(RSS, max_entries=2)
+    assert scanner.done
+    assert len(scanner.content) < len(RSS)
+    document = scanner.document(len(RSS))
+    assert document.endswith(b"<guid>2</guid></item></channel></rss>")
+    assert [post["post_id"] for post in parser.parse(document)["posts"]] == ["1", "2"]
+
+
+def test_scanner_cuts_at_max_bytes():
+    max_bytes = RSS.index(b"Three")
+    scanner = scan(RSS[: max_bytes + 1])
+    document = scanner.document(max_bytes)
+    assert document.endswith(b"<guid>2</guid></item></channel></rss>")
+    assert parser.parse(document)["title"] == "Channel"
+
+
+def test_parse_channel_fallback():
+    document = b'<rss version="2.0"><channel><title>Parsed</title></channel></rss>'
+    channel = {
+        "title": "Scanned",
+        "subtitle": "<script>alert(1)</script>Hi <b>there</b>",
+        "updated": datetime(2023, 11, 16),
+    }
+    parsed = parser.parse(document, channel)
+    assert parsed["title"] == "Parsed"
+    assert parsed["subtitle"] == "Hi <b>there</b>"
+    assert parsed["updated"] == datetime(2023, 11, 16)
+
+
+def test_scanner_not_xml():
+    content = b"<html><p>unclosed</html>" * 10
+    scanner = scan(content)
+    assert not scanner.valid
+    assert not scanner.channel_fields()
+    assert scanner.document(20) == content[:20]
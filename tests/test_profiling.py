@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from rss_reader import api, profiling
+
+
+AUTHORIZATION = {"Authorization": "Bearer s3cret"}
+
+
+@pytest.fixture(name="profile_dir")
+def profile_dir_fixture(tmp_path, mocker):
+    mocker.patch.object(profiling, "PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture(name="profiled_client")
+def profiled_client_fixture(client, profile_dir, mocker):
+    mocker.patch.object(profiling, "PROFILE_TOKEN", "s3cret")
+    middleware = profiling.ProfilingMiddleware(
+        api.app, token="s3cret", sample_rate=0, directory=str(profile_dir), keep=2
+    )
+    return TestClient(middleware)
+
+
+@pytest.mark.parametrize(
+    "token, sample_rate, expected",
+    [(None, 0, False), ("s3cret", 0, True), (None, 0.01, True), ("", 0, False)],
+)
+def test_enabled(token, sample_rate, expected):
+    assert profiling.enabled(token, sample_rate) is expected
+
+
+def test_profile_with_header(profiled_client, profile_dir, reset_db):
+    response = profiled_client.get("/users/", headers={"X-Profile": "s3cret"})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    profiles = profiled_client.get("/admin/profiles/", headers=AUTHORIZATION).json()
+    assert [profile["id"] for profile in profiles] == [profile_id]
+    assert profiles[0]["target"] == "GET /users/"
+    assert profiles[0]["duration"] > 0
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Profile": "wrong"}])
+def test_no_profile_without_authorized_header(profiled_client, profile_dir, headers):
+    response = profiled_client.get("/admin/stats", headers=headers)
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+    assert not list(profile_dir.iterdir())
+
+
+def test_profile_sampled(client, profile_dir):
+    middleware = profiling.ProfilingMiddleware(api.app, sample_rate=1, directory=str(profile_dir))
+    response = TestClient(middleware).get("/admin/stats")
+    assert "X-Profile-Id" in response.headers
+
+
+def test_profiles_pruned(profiled_client, profile_dir):
+    ids = [
+        profiled_client.get("/admin/stats", headers={"X-Profile": "s3cret"}).headers[
+            "X-Profile-Id"
+        ]
+        for _ in range(3)
+    ]
+    assert sorted(path.stem for path in profile_dir.iterdir()) == ids[1:]
+
+
+def test_read_profile(profiled_client):
+    profile_id = profiled_client.get("/admin/stats", headers={"X-Profile": "s3cret"}).headers[
+        "X-Profile-Id"
+    ]
+    response = profiled_client.get(f"/admin/profiles/{profile_id}", headers=AUTHORIZATION)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    response = profiled_client.get(
+        f"/admin/profiles/{profile_id}", params={"format": "speedscope"}, headers=AUTHORIZATION
+    )
+    assert response.status_code == 200
+    assert json.loads(response.text)["$schema"].startswith("https://www.speedscope.app/")
+
+
+@pytest.mark.parametrize("profile_id", ["1700000000000000000-0123abcd", "..%2F..%2Fetc%2Fpasswd"])
+def test_read_profile_not_found(profiled_client, profile_id):
+    response = profiled_client.get(f"/admin/profiles/{profile_id}", headers=AUTHORIZATION)
+    assert response.status_code == 404
+
+
+def test_read_profiles_empty(profiled_client, tmp_path, mocker):
+    mocker.patch.object(profiling, "PROFILE_DIR", str(tmp_path / "missing"))
+    assert not profiled_client.get("/admin/profiles/", headers=AUTHORIZATION).json()
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"Authorization": "Bearer wrong"}, {"Authorization": "s3cret"}, {"X-Profile": "s3cret"}],
+)
+@pytest.mark.parametrize(
+    "path", ["/admin/profiles/", "/admin/profiles/1700000000000000000-0123abcd"]
+)
+def test_read_profiles_unauthorized(profiled_client, path, headers):
+    response = profiled_client.get(path, headers=headers)
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize(
+    "path", ["/admin/profiles/", "/admin/profiles/1700000000000000000-0123abcd"]
+)
+def test_read_profiles_disabled(client, profile_dir, mocker, path):
+    mocker.patch.object(profiling, "PROFILE_TOKEN", None)
+    mocker.patch.object(profiling, "PROFILE_SAMPLE_RATE", 0)
+    response = client.get(path, headers=AUTHORIZATION)
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Profiling is disabled"}
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, select
+
+from rss_reader import db, feedsvc, scheduler
+
+
+NOW = datetime(2023, 11, 16, 13, 54, 19)
+
+
+@pytest.mark.parametrize(
+    "interval, changed, expected",
+    [
+        (None, True, scheduler.DEFAULT_INTERVAL),
+        (None, False, scheduler.DEFAULT_INTERVAL),
+        (3600, True, 1800),
+        (3600, False, 5400),
+        (scheduler.MIN_INTERVAL, True, scheduler.MIN_INTERVAL),
+        (scheduler.MAX_INTERVAL, False, scheduler.MAX_INTERVAL),
+    ],
+)
+def test_reschedule(interval: int, changed: bool, expected: int):
+    feed = db.Feed(url="https://feeds.com/", fetch_interval=interval)
+    scheduler.reschedule(feed, changed, NOW)
+    assert feed.fetch_interval == expected
+    assert feed.next_fetch_at == NOW + timedelta(seconds=expected)
+
+
+def post(post_id: str, title: str) -> dict:
+    return {"post_id": post_id, "title": title, "link": None, "summary": None, "published": NOW}
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        feedsvc.Document(status=feedsvc.FetchStatus.FAILED),
+        feedsvc.Document(status=feedsvc.FetchStatus.SKIPPED, retry_after=60),
+    ],
+)
+def test_refresh_failed_fetch(document, mocker):
+    mocker.patch("rss_reader.feedsvc.fetch", return_value=document)
+    feed = db.Feed(
+        url="https://down.com/",
+        title="title",
+        updated=NOW,
+        etag='"v1"',
+        modified="today",
+        fetch_interval=3600,
+    )
+    assert not asyncio.run(scheduler.refresh(feed))
+    assert (feed.title, feed.updated, feed.etag, feed.modified) == ("title", NOW, '"v1"', "today")
+    assert feed.fetch_interval == 3600
+
+
+def test_run_once(reset_db: db.Engine, session: Session, mocker):
+    async def replenish(feed: db.Feed) -> list:
+        feed.updated = NOW
+        return [post(f"{feed.url}1", "1"), post(f"{feed.url}2", "2")]
+
+    replenish_mock = mocker.patch("rss_reader.feedsvc.replenish", side_effect=replenish)
+    past, future = db.utcnow() - timedelta(minutes=1), db.utcnow() + timedelta(hours=1)
+    quiet = db.Feed(url="https://quiet.com/", fetch_interval=3600, next_fetch_at=past)
+    session.add_all(
+        [
+            db.Feed(url="https://busy.com/", fetch_interval=3600, next_fetch_at=past),
+            quiet,
+            db.Feed(url="https://later.com/", fetch_interval=3600, next_fetch_at=future),
+        ]
+    )
+    session.commit()
+    db.upsert_posts(
+        session, [dict(post(f"https://quiet.com/{i}", "0"), feed_id=quiet.id) for i in (1, 2)]
+    )
+    assert asyncio.run(scheduler.run_once(reset_db)) == 2
+    assert replenish_mock.await_count == 2
+    session.expire_all()
+    feeds = {feed.url: feed for feed in db.get_feeds(session)}
+    assert feeds["https://busy.com/"].fetch_interval == 1800
+    assert feeds["https://busy.com/"].next_fetch_at > past
+    assert feeds["https://quiet.com/"].fetch_interval == 5400
+    assert feeds["https://later.com/"].fetch_interval == 3600
+    assert feeds["https://later.com/"].next_fetch_at == future
+    posts = session.exec(select(db.Post).order_by(db.Post.post_id)).all()
+    assert [post.post_id for post in posts] == [
+        "https://busy.com/1",
+        "https://busy.com/2",
+        "https://quiet.com/1",
+        "https://quiet.com/2",
+    ]
+    assert posts[0].feed_id == feeds["https://busy.com/"].id
+    assert posts[0].title == "1"
+
+
+def test_run_once_new_posts(reset_db: db.Engine, session: Session, mocker):
+    post_ids = ["https://undated.com/1"]
+
+    async def replenish(feed: db.Feed) -> list:
+        feed.updated = db.utcnow()  # as if regenerated on every request
+        return [post(post_id, post_id) for post_id in post_ids]
+
+    mocker.patch("rss_reader.feedsvc.replenish", side_effect=replenish)
+    feed = db.Feed(url="https://undated.com/", fetch_interval=3600)
+    session.add(feed)
+    session.commit()
+    intervals = []
+    for new_post_ids in [[], ["https://undated.com/2"], []]:
+        post_ids.extend(new_post_ids)
+        feed.next_fetch_at = db.utcnow()
+        session.commit()
+        asyncio.run(scheduler.run_once(reset_db))
+        session.refresh(feed)
+        intervals.append(feed.fetch_interval)
+    assert intervals == [1800, 900, 1350]
+
+
+def test_run_once_feed_deleted(reset_db: db.Engine, session: Session, mocker):
+    held = []
+
+    async def replenish(feed: db.Feed) -> list:
+        held.append(db.pool_stats(reset_db)["checked_out"])
+        if "deleted" in feed.url:
+            db.delete_feed(session, db.stored_id(feed))
+        return [post(f"{feed.url}1", "1")]
+
+    mocker.patch("rss_reader.feedsvc.replenish", side_effect=replenish)
+    session.add_all(
+        [
+            db.Feed(url="https://deleted.com/", fetch_interval=3600),
+            db.Feed(url="https://kept.com/", fetch_interval=3600),
+        ]
+    )
+    session.commit()
+    assert asyncio.run(scheduler.run_once(reset_db)) == 2
+    assert held == [0, 0]
+    session.expire_all()
+    feeds = db.get_feeds(session)
+    assert [(feed.url, feed.fetch_interval) for feed in feeds] == [("https://kept.com/", 1800)]
+    posts = session.exec(select(db.Post)).all()
+    assert [post.post_id for post in posts] == ["https://kept.com/1"]
+
+
+def test_run_failed_batch(mocker):
+    stop = asyncio.Event()
+
+    async def run_once(*args) -> int:
+        if run_once_mock.await_count == 1:
+            raise RuntimeError("boom")
+        stop.set()
+        return 0
+
+    run_once_mock = mocker.patch("rss_reader.scheduler.run_once", side_effect=run_once)
+    asyncio.run(scheduler.run(mocker.Mock(), poll_interval=0, stop=stop))
+    assert run_once_mock.await_count == 2
+
+
+def test_run_once_failure(reset_db: db.Engine, session: Session, mocker):
+    mocker.patch("rss_reader.feedsvc.replenish", side_effect=RuntimeError("boom"))
+    session.add(db.Feed(url="https://broken.com/", fetch_interval=3600))
+    session.commit()
+    assert asyncio.run(scheduler.run_once(reset_db)) == 1
+    session.expire_all()
+    feed = db.get_feeds(session)[0]
+    assert feed.fetch_interval == 5400
+    assert feed.next_fetch_at > db.utcnow()
+    assert asyncio.run(scheduler.run_once(reset_db)) == 0
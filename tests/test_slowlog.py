@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+import asyncio
+
+import pytest
+import sqlalchemy
+
+from rss_reader import db, slowlog
+
+
+@pytest.fixture(name="slow_log")
+def slow_log_fixture(engine):
+    slow_log = slowlog.SlowQueryLog(threshold=0, explain_plans=True)
+    slow_log.instrument(engine)
+    yield slow_log
+    sqlalchemy.event.remove(engine, "before_cursor_execute", slow_log.before_cursor_execute)
+    sqlalchemy.event.remove(engine, "after_cursor_execute", slow_log.after_cursor_execute)
+
+
+@pytest.mark.parametrize(
+    "statement, expected",
+    [
+        (
+            "SELECT feed.id FROM feed\n WHERE feed.url = %(url_1)s LIMIT 10",
+            "SELECT feed.id FROM feed WHERE feed.url = ? LIMIT ?",
+        ),
+        (
+            "SELECT * FROM post WHERE id IN ($1::INTEGER, $2::INTEGER) OR title = 'it''s'",
+            "SELECT * FROM post WHERE id IN (...) OR title = ?",
+        ),
+        (
+            "INSERT INTO user (username) VALUES (?), (?), (?)",
+            "INSERT INTO user (username) VALUES (...), ...",
+        ),
+        ("UPDATE feed SET title=:title WHERE id = :id_1", "UPDATE feed SET title=? WHERE id = ?"),
+    ],
+)
+def test_normalize(statement: str, expected: str):
+    assert slowlog.normalize(statement) == expected
+
+
+@pytest.mark.parametrize(
+    "parameters, executemany, expected",
+    [
+        ({"username": "bob", "limit": 10}, False, "{username: str, limit: int}"),
+        (("bob", None), False, "(str, NoneType)"),
+        ([{"url": "https://feeds.com"}] * 3, True, "3 x {url: str}"),
+        (tuple(range(11)), False, "(11 params)"),
+        (None, False, ""),
+    ],
+)
+def test_params_shape(parameters, executemany: bool, expected: str):
+    assert slowlog.params_shape(parameters, executemany) == expected
+
+
+def test_slow_queries_aggregated(engine, slow_log):
+    with engine.connect() as conn:
+        for value in range(3):
+            conn.execute(sqlalchemy.text("SELECT :value + 1"), {"value": value}).all()
+    query = next(query for query in slow_log.top() if query["statement"] == "SELECT ? + ?")
+    assert query["calls"] == 3
+    assert query["max"] <= query["total"]
+    assert query["mean"] == pytest.approx(query["total"] / 3)
+    assert query["plan"]
+
+
+def test_fast_queries_ignored():
+    slow_log = slowlog.SlowQueryLog(threshold=60)
+    engine = sqlalchemy.create_engine("sqlite://")
+    slow_log.instrument(engine)
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1"))
+    assert not slow_log.top()
+
+
+def test_only_selects_explained(engine, slow_log, reset_db):
+    with db.Session(engine) as session:
+        db.add_user(session, db.User(username="bob"))
+        db.get_user(session, "bob")
+    queries = slow_log.top(100)
+    assert any(query["plan"] for query in queries if query["statement"].startswith("SELECT"))
+    assert all(
+        query["plan"] is None for query in queries if query["statement"].startswith("INSERT")
+    )
+
+
+def test_explain_failure(engine):
+    with engine.connect() as conn:
+        assert slowlog.explain(conn, "SELECT * FROM no_such_table", ()) is None
+        assert conn.execute(sqlalchemy.text("SELECT 1")).scalar() == 1
+
+
+def test_top_by_total_time():
+    slow_log = slowlog.SlowQueryLog(threshold=0, size=2)
+    slow_log.record(None, "SELECT 1", (), False, 0.5)
+    slow_log.record(None, "SELECT a FROM t", (), False, 2)
+    slow_log.record(None, "SELECT 2", (), False, 1)
+    assert [query["statement"] for query in slow_log.top()] == ["SELECT a FROM t", "SELECT ?"]
+    assert slow_log.top()[1]["calls"] == 2
+    assert [query["statement"] for query in slow_log.top(1)] == ["SELECT a FROM t"]
+    slow_log.record(None, "SELECT b FROM t", (), False, 0.1)
+    assert [query["statement"] for query in slow_log.top()] == [
+        "SELECT a FROM t",
+        "SELECT b FROM t",
+    ]
+
+
+def test_async_engine_instrumented(mocker):
+    slow_log = slowlog.SlowQueryLog(threshold=0)
+    mocker.patch("rss_reader.slowlog.get_slow_query_log", return_value=slow_log)
+
+    async def execute():
+        async_engine = db.create_async_engine.__wrapped__("sqlite://")
+        async with async_engine.connect() as conn:
+            await conn.execute(sqlalchemy.text("SELECT 42"))
+        await async_engine.dispose()
+
+    asyncio.run(execute())
+    assert [query["statement"] for query in slow_log.top()] == ["SELECT ?"]
+
+
+def test_read_slow_queries(client, mocker):
+    slow_log = slowlog.SlowQueryLog(threshold=0)
+    slow_log.record(None, "SELECT * FROM feed WHERE url = 'x'", ("x",), False, 0.25)
+    mocker.patch("rss_reader.slowlog.get_slow_query_log", return_value=slow_log)
+    response = client.get("/admin/slow-queries", params={"limit": 5})
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "statement": "SELECT * FROM feed WHERE url = ?",
+            "calls": 1,
+            "total": 0.25,
+            "max": 0.25,
+            "mean": 0.25,
+            "params": "(str)",
+            "plan": None,
+        }
+    ]
+    assert client.get("/admin/slow-queries", params={"limit": 0}).status_code == 422
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of rss-reader
+# https://github.com/scorphus/rss-reader
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2023, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+# pylint: disable=redefined-outer-name,unused-argument
+
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from rss_reader import db
+
+
+def make_post(feed: db.Feed, number: int, published: bool = True):
+    return {
+        "post_id": f"{feed.url}#{number}",
+        "title": f"Post {number}",
+        "link": f"{feed.url}/{number}",
+        "summary": None,
+        "published": datetime(2023, 11, number) if published else None,
+        "feed_id": feed.id,
+    }
+
+
+@pytest.fixture(name="feeds")
+def feeds_fixture(reset_db: db.Engine, session: Session):
+    feeds = [db.add_feed(session, db.Feed(url=f"https://{name}.com/rss")) for name in "ab"]
+    db.add_user(session, db.User(username="rory"))
+    db.upsert_posts(session, [make_post(feeds[0], 1), make_post(feeds[1], 2)])
+    return feeds
+
+
+def timeline(client: TestClient, **params):
+    response = client.get("/users/rory/timeline", params=params)
+    assert response.status_code == 200
+    return response
+
+
+def test_subscribe_backfills_timeline(client: TestClient, feeds):
+    assert client.put(f"/users/rory/subscriptions/{feeds[0].id}").status_code == 204
+    assert client.put(f"/users/rory/subscriptions/{feeds[1].id}").status_code == 204
+    assert client.put(f"/users/rory/subscriptions/{feeds[1].id}").status_code == 204
+    response = client.get("/users/rory/subscriptions/")
+    assert [feed["id"] for feed in response.json()] == [feeds[0].id, feeds[1].id]
+    assert [post["title"] for post in timeline(client).json()] == ["Post 2", "Post 1"]
+
+
+def test_timeline_fan_out(session: Session, client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    posts = [make_post(feeds[0], 3), make_post(feeds[0], 4, published=False)]
+    db.upsert_posts(session, posts + [make_post(feeds[1], 5)])
+    titles = [post["title"] for post in timeline(client).json()]
+    assert titles == ["Post 3", "Post 1", "Post 4"]
+
+
+def test_timeline_paginated(session: Session, client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    db.upsert_posts(session, [make_post(feeds[0], n, n % 3 != 0) for n in range(2, 10)])
+    response = timeline(client, limit=2)
+    titles = [post["title"] for post in response.json()]
+    while after := response.headers.get("X-Next-Cursor"):
+        response = timeline(client, limit=2, after=after)
+        titles += [post["title"] for post in response.json()]
+    assert titles == [f"Post {n}" for n in (8, 7, 5, 4, 2, 1, 9, 6, 3)]
+
+
+def test_timeline_invalid_cursor(client: TestClient, feeds):
+    response = client.get("/users/rory/timeline", params={"after": "bm9wZQ"})
+    assert response.status_code == 400
+
+
+def test_unsubscribe(client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    client.put(f"/users/rory/subscriptions/{feeds[1].id}")
+    assert client.delete(f"/users/rory/subscriptions/{feeds[1].id}").status_code == 204
+    assert [post["title"] for post in timeline(client).json()] == ["Post 1"]
+    response = client.delete(f"/users/rory/subscriptions/{feeds[1].id}")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Subscription not found"
+
+
+@pytest.mark.parametrize(
+    "method,path",
+    [
+        ("put", "/users/nobody/subscriptions/1"),
+        ("put", "/users/rory/subscriptions/999"),
+        ("get", "/users/nobody/subscriptions/"),
+        ("get", "/users/nobody/timeline"),
+    ],
+)
+def test_subscriptions_not_found(client: TestClient, feeds, method: str, path: str):
+    assert client.request(method, path).status_code == 404
+
+
+def test_subscribe_feed_deleted_after_cached(session: Session, client: TestClient, feeds):
+    assert client.get(f"/feeds/{feeds[0].id}").status_code == 200
+    db.delete_feed(session, feeds[0].id)
+    response = client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "User or feed not found"}
+    assert client.put(f"/users/rory/subscriptions/{feeds[1].id}").status_code == 204
+
+
+def test_delete_feed_clears_timeline(client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    client.delete(f"/feeds/{feeds[0].id}")
+    assert not timeline(client).json()
+    assert not client.get("/users/rory/subscriptions/").json()
+
+
+def unread(client: TestClient):
+    response = client.get("/users/rory/unread")
+    assert response.status_code == 200
+    return {count["feed_id"]: count["unread_count"] for count in response.json()}
+
+
+def test_unread_counts(session: Session, client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    client.put(f"/users/rory/subscriptions/{feeds[1].id}")
+    assert unread(client) == {feeds[0].id: 1, feeds[1].id: 1}
+    db.upsert_posts(session, [make_post(feeds[0], n) for n in range(1, 5)])
+    db.upsert_posts(session, [dict(make_post(feeds[0], 4), title="Updated")])
+    assert unread(client) == {feeds[0].id: 4, feeds[1].id: 1}
+
+
+def test_mark_read(session: Session, client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    client.put(f"/users/rory/subscriptions/{feeds[1].id}")
+    db.upsert_posts(session, [make_post(feeds[0], n) for n in range(3, 6)])
+    ids = {post["title"]: post["id"] for post in timeline(client).json()}
+    post_ids = [ids["Post 3"], ids["Post 2"], ids["Post 3"], 999]
+    assert client.post("/users/rory/read", json=post_ids).status_code == 204
+    assert client.post("/users/rory/read", json=[ids["Post 2"]]).status_code == 204
+    assert unread(client) == {feeds[0].id: 3, feeds[1].id: 0}
+    user = db.get_user(session, "rory")
+    assert user is not None
+    sub = session.get(db.FeedUserSub, (user.id, feeds[0].id))
+    assert sub is not None and sub.read_ids == [ids["Post 3"]]
+
+
+def test_mark_feed_read(session: Session, client: TestClient, feeds):
+    client.put(f"/users/rory/subscriptions/{feeds[0].id}")
+    client.put(f"/users/rory/subscriptions/{feeds[1].id}")
+    db.upsert_posts(session, [make_post(feeds[0], n) for n in range(3, 6)])
+    ids = {post["title"]: post["id"] for post in timeline(client).json()}
+    client.post("/users/rory/read", json=[ids["Post 4"]])
+    response = client.post(f"/users/rory/subscriptions/{feeds[0].id}/read")
+    assert response.status_code == 204
+    assert unread(client) == {feeds[0].id: 0, feeds[1].id: 1}
+    client.post("/users/rory/read", json=[ids["Post 5"]])
+    db.upsert_posts(session, [make_post(feeds[0], 6)])
+    assert unread(client) == {feeds[0].id: 1, feeds[1].id: 1}
+    assert client.post("/users/rory/subscriptions/read").status_code == 204
+    assert unread(client) == {feeds[0].id: 0, feeds[1].id: 0}
+
+
+def test_mark_feed_read_not_subscribed(client: TestClient, feeds):
+    response = client.post(f"/users/rory/subscriptions/{feeds[0].id}/read")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Subscription not found"